@@ -1,14 +1,35 @@
+import asyncio
+from contextlib import contextmanager
 from unittest.mock import patch
 
 import pytest
+from aiohttp import ClientConnectionError
 from eth_utils import to_checksum_address
+from hexbytes import HexBytes
 from web3.constants import ADDRESS_ZERO
 
-from web3mc import Multicall
+from web3mc import HedgingPolicy, Multicall, RateLimit, ResultCache
+from web3mc import multicall as multicall_module
 from web3mc.abi import multicall2_abi
 from web3mc.auto import multicall
-from web3mc.constants import MULTICALL2_ADDRESSES
-from web3mc.exceptions import MaxRetriesExceeded
+from web3mc.call import Call, CallTemplate, SignatureCall
+from web3mc.columns import Columns
+from web3mc.constants import MULTICALL2_ADDRESSES, MULTICALL3_BYTECODE
+from web3mc.exceptions import CallsReverted, MaxRetriesExceeded
+
+
+@contextmanager
+def _code(m: Multicall, code: str):
+    # multicall code returned to setup of m
+    request = m._transport.request
+
+    async def get_code(method, params, *args):
+        if method == "eth_getCode":
+            return code
+        return await request(method, params, *args)
+
+    with patch.object(m._transport, "request", get_code):
+        yield
 
 
 class TestAggregate:
@@ -115,9 +136,62 @@ class TestAggregate:
             assert res == ["Wrapped Ether", "WETH", 18, None]
 
         else:
-            with pytest.raises(MaxRetriesExceeded):
+            with pytest.raises(MaxRetriesExceeded) as e:
                 multicall.aggregate(calls)
 
+            assert e.value.failed_batches == [0]
+
+    def test_allow_failure(self, weth, test_contract):
+        health = test_contract.functions.health("0x1234567891011121314151617181920212223242", False)
+        calls = [weth.functions.name(), weth.functions.symbol(), weth.functions.decimals(), health]
+
+        assert multicall.aggregate(calls, allow_failure=[False, False, False, True]) == [
+            "Wrapped Ether",
+            "WETH",
+            18,
+            None,
+        ]
+        with pytest.raises(MaxRetriesExceeded):
+            multicall.aggregate(calls, use_try=True, allow_failure=[True, True, True, False])
+
+    def test_retry_per_batch(self, weth, wbtc):
+        m = Multicall(batch=3, max_retries=3, retry_backoff=0.01)
+        calls = [weth.functions.name(), weth.functions.symbol(), weth.functions.decimals()]
+        calls += [wbtc.functions.name(), wbtc.functions.symbol(), wbtc.functions.decimals()]
+        encoded_data = Call(calls, None).encoded_data
+        first, fourth = encoded_data[0], encoded_data[3]
+        sent, succeeded = {}, []
+        call_aggregate = m._call_aggregate
+
+        async def flaky(allow_failure, call_data, return_types, block_identifier):
+            batch = tuple(call_data)
+            sent[batch] = sent.get(batch, 0) + 1
+            # first batch is too large, its half with the first call and the second batch fail twice
+            if first in batch and len(batch) == 3:
+                raise ValueError("out of gas")
+            if (first in batch or fourth in batch) and sent[batch] <= 2:
+                raise ValueError("header not found")
+            succeeded.append(batch)
+            return await call_aggregate(allow_failure, call_data, return_types, block_identifier)
+
+        # failures of different batches don't add up to max_retries, successful batches aren't sent again
+        with patch.object(m, "_call_aggregate", flaky):
+            assert m.aggregate(calls) == ["Wrapped Ether", "WETH", 18, "Wrapped BTC", "WBTC", 8]
+        assert len(succeeded) == len(set(succeeded))
+        assert all(sent[batch] == (3 if first in batch or fourth in batch else 1) for batch in succeeded)
+        m.close()
+
+    def test_isolate_failures(self, weth, test_contract):
+        m = Multicall(batch=3)
+        health = test_contract.functions.health("0x1234567891011121314151617181920212223242", False)
+        calls = [weth.functions.name(), weth.functions.symbol(), weth.functions.decimals(), health] * 2
+
+        with pytest.raises(CallsReverted) as e:
+            m.aggregate(calls, isolate_failures=True)
+
+        assert e.value.indexes == [3, 7]
+        assert e.value.results == ["Wrapped Ether", "WETH", 18, None] * 2
+
     @pytest.mark.parametrize("use_try", (True, False))
     def test_multiple_batches(self, weth, wbtc, dai, usdc, usdt, use_try):
         m = Multicall(batch=3)
@@ -144,6 +218,414 @@ class TestAggregate:
             6,
         ]
 
+    @pytest.mark.parametrize("use_try", (True, False))
+    def test_contract_function_path(self, weth, use_try):
+        m = Multicall(fast_path=False)
+
+        calls = [weth.functions.name(), weth.functions.symbol(), weth.functions.decimals()]
+        assert m.aggregate(calls, use_try=use_try) == multicall.aggregate(calls, use_try=use_try)
+        assert m.aggregate(calls, allow_failure=[use_try, True, False]) == ["Wrapped Ether", "WETH", 18]
+
+    @pytest.mark.parametrize("use_try", (True, False))
+    def test_compact(self, weth, wbtc, test_contract, use_try):
+        m = Multicall(compact=True)
+
+        calls = [
+            weth.functions.name(),
+            weth.functions.decimals(),
+            weth.functions.balanceOf(ADDRESS_ZERO),
+            wbtc.functions.symbol(),
+            wbtc.functions.decimals(),
+        ]
+        assert m.aggregate(calls, use_try=use_try) == multicall.aggregate(calls, use_try=use_try)
+
+        calls = calls[:2] + [test_contract.functions.health("0x1234567891011121314151617181920212223242", False)]
+        assert m.aggregate(calls, allow_failure=[False, False, True]) == ["Wrapped Ether", 18, None]
+
+    def test_template(self, weth, wbtc, dai):
+        holders = [weth.address, wbtc.address, dai.address, ADDRESS_ZERO]
+        call = Call.from_template(
+            CallTemplate(weth.functions.balanceOf), [(holder,) for holder in holders], weth.address
+        )
+        assert multicall.aggregate(call) == multicall.aggregate([weth.functions.balanceOf(h) for h in holders])
+
+        call = Call.from_template(CallTemplate("symbol()(string)"), [()] * 3, [weth.address, wbtc.address, dai.address])
+        assert multicall.aggregate(call, use_try=True) == ["WETH", "WBTC", "DAI"]
+
+    @pytest.mark.parametrize("use_try", (True, False))
+    def test_signature_calls(self, weth, wbtc, use_try):
+        calls = [
+            SignatureCall("name()(string)", weth.address),
+            weth.functions.symbol(),
+            SignatureCall("decimals()(uint8)", wbtc.address),
+            SignatureCall("balanceOf(address)(uint256)", weth.address, wbtc.address),
+        ]
+        result = multicall.aggregate(calls, use_try=use_try)
+        assert result == ["Wrapped Ether", "WETH", 8, multicall.aggregate([weth.functions.balanceOf(wbtc.address)])[0]]
+
+    @pytest.mark.parametrize("compact", (True, False))
+    def test_columns(self, weth, wbtc, dai, test_contract, compact):
+        np = pytest.importorskip("numpy")
+        m = Multicall(compact=compact)
+
+        calls = [weth.functions.decimals(), wbtc.functions.decimals(), dai.functions.decimals()]
+        (decimals,) = m.aggregate(calls, columns=True)
+        assert decimals.dtype == np.uint8
+        assert decimals.tolist() == [18, 8, 18]
+
+        calls = [weth.functions.balanceOf(ADDRESS_ZERO), weth.functions.balanceOf(wbtc.address)]
+        failing = SignatureCall("balanceOf(address)(uint256)", test_contract.address, ADDRESS_ZERO)
+        columns = m.aggregate(calls + [failing], use_try=True, columns=True)
+        assert columns.valid.tolist() == [True, True, False]
+        assert columns[0].tolist()[:2] == m.aggregate(calls)
+
+        with pytest.raises(ValueError):
+            m.aggregate([weth.functions.decimals(), weth.functions.name()], columns=True)
+
+    @pytest.mark.parametrize("chunk_size", (1, 2, 10))
+    def test_aggregate_iter(self, weth, wbtc, dai, chunk_size):
+        calls = (contract.functions.symbol() for contract in (weth, wbtc, dai) * 3)
+        chunks = dict(multicall.aggregate_iter(calls, chunk_size=chunk_size, max_pending=2))
+
+        assert sorted(chunks) == list(range(0, 9, chunk_size))
+        assert [result for start in sorted(chunks) for result in chunks[start]] == ["WETH", "WBTC", "DAI"] * 3
+
+    def test_async_aggregate_iter(self, weth, test_contract):
+        calls = [
+            weth.functions.name(),
+            test_contract.functions.health("0x1234567891011121314151617181920212223242", False),
+            weth.functions.decimals(),
+        ]
+
+        async def main():
+            return [chunk async for chunk in multicall.async_aggregate_iter(calls, use_try=True, chunk_size=2)]
+
+        assert sorted(asyncio.run(main())) == [(0, ["Wrapped Ether", None]), (2, [18])]
+
+        with pytest.raises(CallsReverted) as e:
+            list(multicall.aggregate_iter(calls, isolate_failures=True, chunk_size=1))
+        assert e.value.indexes == [1]
+
+    def test_sync_loop(self, weth):
+        m = Multicall()
+        assert m.aggregate([weth.functions.symbol()]) == ["WETH"]
+        loop = m._loop_thread.loop
+        assert m.aggregate([weth.functions.decimals()]) == [18]
+        assert m._loop_thread.loop is loop
+
+        async def main():
+            # sync api inside a running event loop (e.g. notebooks)
+            return m.aggregate([weth.functions.name()])
+
+        assert asyncio.run(main()) == ["Wrapped Ether"]
+        m.close()
+        assert m.aggregate([weth.functions.symbol()]) == ["WETH"]
+        m.close()
+
+    def test_coalesce(self, weth, wbtc, test_contract):
+        m = Multicall(coalesce_window=0.01, retry_backoff=0.01)
+        reverting = test_contract.functions.health("0x1234567891011121314151617181920212223242", False)
+
+        async def main():
+            return await asyncio.gather(
+                m.async_aggregate([weth.functions.symbol(), weth.functions.decimals()]),
+                m.async_aggregate([wbtc.functions.symbol(), reverting], use_try=True),
+                m.async_aggregate([wbtc.functions.decimals(), reverting]),
+                m.async_aggregate([wbtc.functions.decimals()], block_identifier=1),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(main())
+        assert results[:2] == [["WETH", 18], ["WBTC", None]]
+        # caller whose calls reverted retries them on its own
+        assert isinstance(results[2], MaxRetriesExceeded) and results[2].failed_batches == [0]
+        assert results[3] == [8]
+        assert (m._coalescer.submitted, m._coalescer.sent) == (4, 2)
+
+        # aggregates that fill batches on their own are not delayed
+        assert m.aggregate([weth.functions.symbol()] * 100) == ["WETH"] * 100
+        assert m._coalescer.submitted == 4
+        m.close()
+
+    def test_dedupe(self, weth, wbtc, test_contract):
+        m = Multicall()
+        calls = [weth.functions.decimals(), wbtc.functions.decimals()] * 3 + [weth.functions.symbol()]
+        assert m.aggregate(calls) == [18, 8] * 3 + ["WETH"]
+        assert (m.total_calls, m.unique_calls) == (7, 3)
+        assert m.dedupe_ratio == pytest.approx(4 / 7)
+
+        reverting = test_contract.functions.health("0x1234567891011121314151617181920212223242", False)
+        calls = [reverting, weth.functions.decimals(), reverting]
+        with pytest.raises(CallsReverted) as e:
+            m.aggregate(calls, isolate_failures=True)
+        assert e.value.indexes == [0, 2]
+        assert e.value.results == [None, 18, None]
+        with pytest.raises(CallsReverted) as e:
+            m.aggregate(calls, isolate_failures=True, allow_failure=[False, False, True])
+        assert e.value.indexes == [0]
+
+        # a call may fail only if all its copies may
+        assert m.aggregate(calls, allow_failure=[True, False, True]) == [None, 18, None]
+        with pytest.raises(MaxRetriesExceeded):
+            m.aggregate(calls, allow_failure=[True, False, False])
+        m.close()
+
+    @pytest.mark.parametrize("block_identifier", ("latest", 1, 2**64))
+    def test_cache(self, weth, wbtc, test_contract, block_identifier):
+        cache = ResultCache()
+        m = Multicall(cache=cache)
+        reverting = test_contract.functions.health("0x1234567891011121314151617181920212223242", False)
+        calls = [weth.functions.symbol(), wbtc.functions.decimals(), reverting]
+
+        expected = ["WETH", 8, None]
+        assert m.aggregate(calls, block_identifier=block_identifier, use_try=True) == expected
+        assert m.aggregate(calls, block_identifier=block_identifier, use_try=True) == expected
+        # failed calls aren't cached
+        assert (cache.hits, cache.misses, len(cache)) == (2, 4, 2)
+
+        with pytest.raises(CallsReverted) as e:
+            m.aggregate(calls, block_identifier=block_identifier, isolate_failures=True)
+        assert e.value.indexes == [2] and e.value.results == expected
+        assert m.aggregate(calls[:2], block_identifier="pending") == expected[:2]
+        assert cache.hits == 4
+        m.close()
+
+    def test_cache_head(self, weth, wbtc):
+        cache = ResultCache()
+        m = Multicall(cache=cache)
+        calls = [weth.functions.symbol(), wbtc.functions.decimals()]
+        m.aggregate(calls)
+        methods = []
+        request = m._transport.request
+
+        async def record(method, params, *args):
+            methods.append(method)
+            return await request(method, params, *args)
+
+        # head is requested once, deep blocks are then keyed by number without looking them up
+        cache._heads.clear()
+        with patch.object(m._transport, "request", record):
+            for block in range(17_000_000, 17_000_003):
+                assert m.aggregate(calls, block_identifier=block) == ["WETH", 8]
+        assert methods == ["eth_blockNumber"] + ["eth_call"] * 3
+        assert cache.is_final(m.chain_id, 17_000_000)
+        m.close()
+
+    def test_return_block(self, weth, wbtc):
+        m = Multicall(batch=2)
+        calls = [weth.functions.symbol(), wbtc.functions.symbol(), weth.functions.decimals()]
+        block_number, results = m.aggregate(calls, return_block=True)
+        assert results == ["WETH", "WBTC", 18]
+        assert isinstance(block_number, int) and block_number > 0
+        assert m.aggregate(calls, block_identifier=block_number, return_block=True) == (block_number, results)
+        assert m.aggregate([], block_identifier="pending", return_block=True)[1] == []
+
+        blocks = []
+        call_aggregate = m._call_aggregate
+
+        async def record(allow_failure, call_data, return_types, block_identifier):
+            blocks.append(block_identifier)
+            return await call_aggregate(allow_failure, call_data, return_types, block_identifier)
+
+        # batches are sent at hash of the latest block
+        with patch.object(m, "_call_aggregate", record):
+            assert m.aggregate(calls, use_try=True) == results
+        assert len(blocks) == 2 and blocks[0] == blocks[1] and len(blocks[0]) == 32
+        m.close()
+
+    def test_return_block_l1_number(self, weth, wbtc):
+        # on Arbitrum block.number of multicall is the L1 block number, chain's own number comes from the node
+        m = Multicall(batch=2)
+        calls = [weth.functions.symbol(), wbtc.functions.symbol(), weth.functions.decimals()]
+        m.aggregate(calls)
+        head = {}
+        request = m._transport.request
+
+        async def l2_request(method, params, *args):
+            result = await request(method, params, *args)
+            if method == "eth_getBlockByNumber":
+                head.update(result)
+                result = {**result, "number": hex(int(result["number"], 16) + 10**8)}
+            return result
+
+        blocks = []
+        call_aggregate = m._call_aggregate
+
+        async def record(allow_failure, call_data, return_types, block_identifier):
+            blocks.append(block_identifier)
+            return await call_aggregate(allow_failure, call_data, return_types, block_identifier)
+
+        with patch.object(m._transport, "request", l2_request), patch.object(m, "_call_aggregate", record):
+            block_number, results = m.aggregate(calls, return_block=True)
+        assert results == ["WETH", "WBTC", 18]
+        assert block_number == int(head["number"], 16) + 10**8
+        assert blocks == [HexBytes(head["hash"])] * 2
+        m.close()
+
+    def test_aggregate_range(self, weth, wbtc, test_contract):
+        reverting = test_contract.functions.health("0x1234567891011121314151617181920212223242", False)
+        calls = [weth.functions.totalSupply(), wbtc.functions.totalSupply(), reverting]
+        blocks = range(17_000_000, 17_000_005)
+
+        results = dict(multicall.aggregate_range(calls, blocks, use_try=True, max_pending=2))
+        assert sorted(results) == list(blocks)
+        for block in blocks:
+            assert results[block] == multicall.aggregate(calls, block_identifier=block, use_try=True)
+
+        with pytest.raises(MaxRetriesExceeded):
+            list(multicall.aggregate_range(calls, blocks, allow_failure=[True, True, False]))
+
+    def test_aggregate_range_columns(self, weth, wbtc):
+        np = pytest.importorskip("numpy")
+
+        calls = [weth.functions.totalSupply(), wbtc.functions.totalSupply()]
+        blocks = [17_000_000, 17_000_001]
+
+        async def main():
+            return dict([item async for item in multicall.async_aggregate_range(calls, blocks, columns=True)])
+
+        results = asyncio.run(main())
+        matrix = Columns.stack([results[block] for block in blocks])
+        assert matrix[0].shape == (2, 2) and matrix.valid.all()
+        assert matrix[0][1].tolist() == multicall.aggregate(calls, block_identifier=blocks[1])
+        assert isinstance(matrix[0], np.ndarray)
+
+    def test_provider_pool(self, weth, wbtc):
+        # unreachable endpoint is ejected, its requests are sent to the other one
+        m = Multicall(provider_url=["http://127.0.0.1:2", multicall.provider_url], batch=2, auto_tune=True)
+        calls = [weth.functions.symbol(), weth.functions.decimals(), wbtc.functions.symbol(), wbtc.functions.decimals()]
+        # endpoints are tuned on their own
+        assert m.tuner is None and m._max_calls == 2
+        # the first available endpoint is always picked, so the unreachable one is tried until it's ejected
+        with patch("web3mc.pool.random.choices", lambda candidates, weights: candidates[:1]):
+            for _ in range(5):
+                assert m.aggregate(calls) == ["WETH", 18, "WBTC", 8]
+
+        unreachable, endpoint = m.pool.endpoints
+        assert unreachable.state == "open"
+        assert endpoint.state == "closed" and endpoint.latency is not None
+        assert unreachable.cooldown == 30
+        assert m.pool.redispatched == unreachable.requests >= 5
+        assert unreachable.tuner is not endpoint.tuner and endpoint.tuner.concurrency >= 16
+        m.close()
+
+    def test_hedging(self, weth, wbtc):
+        # deadline below any latency, every request is hedged
+        hedging = HedgingPolicy(budget=1.0, min_delay=0.0, min_samples=1)
+        hedging.observe(0.0)
+        m = Multicall(hedging=hedging, batch=1)
+        calls = [weth.functions.symbol(), weth.functions.decimals(), wbtc.functions.symbol(), wbtc.functions.decimals()]
+        assert m.aggregate(calls) == ["WETH", 18, "WBTC", 8]
+        assert hedging.hedged == hedging.requests >= len(calls)
+        m.close()
+
+    def test_state_override(self, weth):
+        calls = [weth.functions.symbol(), weth.functions.decimals()]
+        with patch.dict(multicall_module._deployed, clear=True):
+            m = Multicall(batch=1)
+            with _code(m, MULTICALL3_BYTECODE):
+                assert m.version == 3
+            override = {m.async_contract.address: {"code": MULTICALL3_BYTECODE}}
+            checked = m._deployed_block
+            assert m._block_state_override("latest") is None and m._block_state_override(checked) is None
+            # blocks before the code was checked may be before multicall was deployed
+            assert m._block_state_override(checked - 1) == override
+            assert m._block_state_override(HexBytes(bytes(32))) == override
+
+            params = []
+            request = m._transport.request
+
+            async def record(method, call_params, *args):
+                if method == "eth_call":
+                    params.append(call_params)
+                return await request(method, call_params, *args)
+
+            # batches pinned to the hash of latest block are sent without override
+            with patch.object(m._transport, "request", record):
+                assert m.aggregate(calls) == ["WETH", 18]
+                assert [len(call_params) for call_params in params] == [2, 2]
+                assert m.aggregate(calls, block_identifier=8_000_000) == ["WETH", 18]
+                assert [len(call_params) for call_params in params[2:]] == [3, 3]
+            m.close()
+
+            multicall_module._deployed.clear()
+            m = Multicall()
+            with _code(m, "0x"):
+                assert m.version == 3
+            assert m._deployed_block is None
+            assert m._block_state_override("latest") == {m.async_contract.address: {"code": MULTICALL3_BYTECODE}}
+            assert m.aggregate([weth.functions.symbol()]) == ["WETH"]
+            m.close()
+
+            # resolved by the first aggregate without blocking requests, then cached per provider url
+            multicall_module._deployed.clear()
+            m = Multicall()
+            assert m.aggregate([weth.functions.symbol()]) == ["WETH"]
+            assert m._block_state_override("latest") == {m.async_contract.address: {"code": MULTICALL3_BYTECODE}}
+            m.close()
+            m = Multicall()
+            with patch.object(m._transport, "request") as request:
+                assert m.version == 3
+            request.assert_not_called()
+
+    def test_setup_retry(self, weth):
+        m = Multicall(retry_backoff=0.01)
+        methods = []
+        request = m._transport.request
+
+        async def flaky(method, params, *args):
+            methods.append(method)
+            if method != "eth_call" and methods.count(method) == 1:
+                raise ClientConnectionError("connection reset")
+            return await request(method, params, *args)
+
+        # setup requests of the first aggregate are retried like batches
+        with patch.dict(multicall_module._chain_ids, clear=True), patch.dict(multicall_module._deployed, clear=True):
+            with patch.object(m._transport, "request", flaky):
+                assert m.aggregate([weth.functions.symbol()]) == ["WETH"]
+        assert methods.count("eth_chainId") == methods.count("eth_getCode") == 2
+        m.close()
+
+        # multicall code that can't be checked falls back to state override
+        m = Multicall(retry_backoff=0.01)
+
+        async def failing(method, params, *args):
+            if method == "eth_getCode":
+                raise asyncio.TimeoutError()
+            return await request(method, params, *args)
+
+        with patch.dict(multicall_module._deployed, clear=True), patch.object(m._transport, "request", failing):
+            assert m.aggregate([weth.functions.symbol()]) == ["WETH"]
+        assert m._deployed_block is None
+        m.close()
+
+    def test_lazy(self):
+        # no requests to unreachable provider until first use
+        m = Multicall(provider_url="http://127.0.0.1:1")
+        assert "chain_id" not in m.__dict__
+
+        m = Multicall(provider_url="http://127.0.0.1:1", chain_id=1)
+        assert m.version == 3
+        assert m.async_contract.address == "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+        with pytest.raises(ValueError):
+            Multicall(provider_url="http://127.0.0.1:1", chain_id=123456789)
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        (
+            {"compact": True},
+            {"provider_url": ["http://127.0.0.1:1", "http://127.0.0.1:2"]},
+            {"rate_limit": RateLimit(10)},
+            {"hedging": HedgingPolicy()},
+            {"rpc_batch_bytes": 100_000},
+        ),
+    )
+    def test_fast_path_only(self, kwargs):
+        # options applied by the fast path transport aren't silently ignored by the web3 contract function path
+        with pytest.raises(ValueError, match="fast path"):
+            Multicall(fast_path=False, **kwargs)
+
     @pytest.mark.parametrize("use_try", (True, False))
     def test_call_different_length(self, weth, use_try):
         calls = [
@@ -174,3 +656,4 @@ class TestAggregate:
         ):
             assert multicall.async_contract.address == "0x5BA1e12693Dc8F9c48aAD8770482f4739bEeD696"
             assert multicall.aggregate(calls, use_try=use_try) == ["Wrapped Ether", "WETH", 18]
+            assert multicall.aggregate(calls, allow_failure=[use_try, True, False]) == ["Wrapped Ether", "WETH", 18]
@@ -0,0 +1,75 @@
+from web3mc.cache import ENTRY_OVERHEAD, ResultCache
+
+ADDRESS = "0x0000000000000000000000000000000000000001"
+
+
+def _data(n: int) -> list[tuple[str, str]]:
+    return [(ADDRESS, f"0x{i:08x}") for i in range(n)]
+
+
+class TestResultCache:
+    def test_get_put(self):
+        cache = ResultCache()
+        call_data = _data(3)
+        assert cache.get(1, 100, call_data) == [None] * 3
+
+        cache.put(1, 100, call_data, [(True, b"\x01"), (False, b""), (True, b"")])
+        assert cache.get(1, 100, call_data) == [b"\x01", None, b""]
+        # other chain, block and address case
+        assert cache.get(2, 100, call_data) == [None] * 3
+        assert cache.get(1, 101, call_data) == [None] * 3
+        assert cache.get(1, 100, [(ADDRESS.upper(), call_data[0][1])]) == [b"\x01"]
+        assert (cache.hits, cache.misses) == (3, 10)
+
+    def test_eviction(self):
+        call_data = _data(10)
+        entry_size = ENTRY_OVERHEAD + len(call_data[0][1]) + 32
+        cache = ResultCache(max_bytes=entry_size * 4)
+
+        cache.put(1, 100, call_data[:4], [(True, bytes(32))] * 4)
+        cache.get(1, 100, call_data[:1])
+        cache.put(1, 100, call_data[4:6], [(True, bytes(32))] * 2)
+
+        # least recently used entries are dropped first
+        assert [result is not None for result in cache.get(1, 100, call_data[:6])] == [
+            True,
+            False,
+            False,
+            True,
+            True,
+            True,
+        ]
+        assert len(cache) == 4 and cache.size == entry_size * 4
+
+    def test_reorg(self):
+        cache = ResultCache(confirmations=10)
+        call_data = _data(2)
+        assert not cache.is_final(1, 80)
+
+        cache.set_block(1, 100, b"a" * 32, latest=True)
+        assert cache.is_final(1, 90) and not cache.is_final(1, 91) and not cache.is_final(2, 50)
+
+        cache.put(1, b"a" * 32, call_data, [(True, b"\x01")] * 2)
+        cache.put(1, 90, call_data, [(True, b"\x02")] * 2)
+        cache.set_block(1, 100, b"a" * 32)
+        assert cache.get(1, b"a" * 32, call_data) == [b"\x01"] * 2
+
+        # block 100 was replaced
+        cache.set_block(1, 100, b"b" * 32, latest=True)
+        assert cache.get(1, b"a" * 32, call_data) == [None] * 2
+        assert cache.get(1, 90, call_data) == [b"\x02"] * 2
+        assert len(cache) == 2
+
+    def test_head(self):
+        cache = ResultCache(confirmations=10, head_ttl=60)
+        assert cache.head_expired(1)
+
+        cache.set_head(1, 100)
+        assert not cache.head_expired(1) and cache.head_expired(2)
+        assert cache.is_final(1, 90)
+        # head of a lagging provider
+        cache.set_head(1, 95)
+        assert cache.is_final(1, 90)
+
+        cache.head_ttl = 0
+        assert cache.head_expired(1)
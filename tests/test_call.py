@@ -0,0 +1,164 @@
+import pytest
+from eth_abi import encode
+from web3 import Web3
+
+from web3mc.call import Call, CallTemplate, SignatureCall, decode_return_data, parse_signature
+
+ADDRESSES = [
+    "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2",
+    "0x2260FAC5E5542a773Aa44fBCfeDf7C193bc2C599",
+    "0x6B175474E89094C44Da98b954EedeAC495271d0F",
+]
+
+ABI = [
+    {
+        "stateMutability": "view",
+        "type": "function",
+        "name": "health",
+        "inputs": [{"name": "user", "type": "address"}, {"name": "full", "type": "bool"}],
+        "outputs": [{"name": "", "type": "int256"}],
+    },
+    {
+        "stateMutability": "view",
+        "type": "function",
+        "name": "quote",
+        "inputs": [
+            {"name": "path", "type": "bytes"},
+            {"name": "amounts", "type": "uint256[]"},
+            {"name": "key", "type": "bytes32"},
+            {"name": "delta", "type": "int128"},
+        ],
+        "outputs": [{"name": "", "type": "uint256"}, {"name": "", "type": "string"}],
+    },
+]
+
+contract = Web3().eth.contract(ADDRESSES[0], abi=ABI)
+
+
+class TestCallTemplate:
+    def test_static(self):
+        template = CallTemplate(ABI[0])
+        args = [(address, full) for address in ADDRESSES for full in (True, False)]
+        assert template.encode_many(args) == [contract.functions.health(*a)._encode_transaction_data() for a in args]
+        assert template.return_types == ["int256"]
+
+    def test_dynamic(self):
+        template = CallTemplate(contract.functions.quote)
+        args = [(b"\x01" * 43, [1, 2, 3], b"\x02" * 32, -5), ("0x1234", [], "0x" + "03" * 32, 2**127 - 1)]
+        assert template.encode_many(args) == [contract.functions.quote(*a)._encode_transaction_data() for a in args]
+        assert template.return_types == ["uint256", "string"]
+
+    def test_signature(self):
+        template = CallTemplate("health(address,bool)(int256)")
+        assert (
+            template.encode(ADDRESSES[1], True)
+            == contract.functions.health(ADDRESSES[1], True)._encode_transaction_data()
+        )
+        assert CallTemplate("balanceOf(address)(uint256)").selector.hex() == "70a08231"
+
+    @pytest.mark.parametrize(
+        "args",
+        (
+            (ADDRESSES[0], 1),
+            ("0x1234", True),
+        ),
+    )
+    def test_invalid_args(self, args):
+        with pytest.raises(ValueError):
+            CallTemplate(ABI[0]).encode(*args)
+
+    @pytest.mark.parametrize("value", (-1, 2**256))
+    def test_out_of_bounds(self, value):
+        with pytest.raises(ValueError):
+            CallTemplate("balanceOf(uint256)(uint256)").encode(value)
+
+    def test_from_template(self):
+        template = CallTemplate("balanceOf(address)(uint256)")
+        call = Call.from_template(template, [(address,) for address in ADDRESSES], ADDRESSES[0])
+        assert len(call) == 3
+        assert call.encoded_data[1] == (ADDRESSES[0], template.encode(ADDRESSES[1]))
+        assert call.return_types == [["uint256"]] * 3
+
+        with pytest.raises(AssertionError):
+            Call.from_template(template, [(address,) for address in ADDRESSES], ADDRESSES[:2])
+
+
+class TestSignatureCall:
+    def test_encode(self):
+        call = SignatureCall("health(address,bool)(int256)", ADDRESSES[0], ADDRESSES[1], True)
+        assert (
+            call._encode_transaction_data() == contract.functions.health(ADDRESSES[1], True)._encode_transaction_data()
+        )
+        assert not hasattr(call, "__dict__")
+
+    def test_shared_template(self):
+        calls = [SignatureCall("balanceOf(address)(uint256)", ADDRESSES[0], address) for address in ADDRESSES]
+        assert len({id(call.template) for call in calls}) == 1
+
+    def test_call(self):
+        calls = [
+            SignatureCall("health(address,bool)(int256)", ADDRESSES[2], ADDRESSES[1], False),
+            contract.functions.health(ADDRESSES[1], False),
+            SignatureCall("name()(string)", ADDRESSES[1]),
+        ]
+        call = Call(calls, None)
+        assert call.encoded_data[0] == (ADDRESSES[2], call.encoded_data[1][1])
+        assert call.encoded_data[2] == (ADDRESSES[1], "0x06fdde03")
+        assert call.return_types == [["int256"], ["int256"], ["string"]]
+
+
+class TestParseSignature:
+    @pytest.mark.parametrize(
+        "signature, parsed",
+        (
+            ("name()(string)", ("name", [], ["string"])),
+            ("balanceOf(address)(uint256)", ("balanceOf", ["address"], ["uint256"])),
+            (
+                "f((uint256,address)[],bool)((int8,bytes),uint256[4])",
+                ("f", ["(uint256,address)[]", "bool"], ["(int8,bytes)", "uint256[4]"]),
+            ),
+            ("approve(address,uint256)", ("approve", ["address", "uint256"], [])),
+        ),
+    )
+    def test_parse(self, signature, parsed):
+        assert parse_signature(signature) == parsed
+
+    @pytest.mark.parametrize("signature", ("balanceOf", "(address)(uint256)", "balanceOf(address)uint256", "f(uint256"))
+    def test_invalid(self, signature):
+        with pytest.raises(ValueError):
+            parse_signature(signature)
+
+
+class TestDecodeReturnData:
+    @pytest.mark.parametrize(
+        "return_type, value",
+        (
+            (["uint256"], 2**256 - 1),
+            (["int8"], -128),
+            (["address"], ADDRESSES[1]),
+            (["bool"], True),
+            (["bytes4"], b"\x01\x02\x03\x04"),
+            (["uint256[4]"], [1, 2, 3, 4]),
+            (["(uint256,address)[2]"], [(1, ADDRESSES[0]), (2, ADDRESSES[2])]),
+            (["uint256", "(bool,int256)", "address[2]"], [5, (False, -1), ADDRESSES[:2]]),
+            (["uint256", "string"], [5, "Wrapped Ether"]),
+        ),
+    )
+    def test_decode(self, return_type, value):
+        data = encode(return_type, [value] if len(return_type) == 1 else value)
+        assert decode_return_data(data, return_type, Web3().codec) == value
+        assert decode_return_data(data + b"\x01" * 32, return_type, Web3().codec) == value
+
+    @pytest.mark.parametrize(
+        "return_type, data",
+        (
+            (["uint8"], (256).to_bytes(32, "big")),
+            (["int8"], (128).to_bytes(32, "big")),
+            (["bool"], (2).to_bytes(32, "big")),
+            (["address"], b"\x01" * 32),
+            (["bytes4"], b"\x01" * 32),
+            (["uint256[2]"], bytes(48)),
+        ),
+    )
+    def test_invalid(self, return_type, data):
+        assert decode_return_data(data, return_type, Web3().codec) is None
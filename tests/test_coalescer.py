@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from web3mc.call import Call
+from web3mc.coalescer import Coalescer
+
+
+def _call(*values: int) -> Call:
+    call = Call([], None)
+    call.encoded_data = [("0x0000000000000000000000000000000000000001", hex(value)) for value in values]
+    call.return_types = [["uint256"]] * len(values)
+    return call
+
+
+class _Execute:
+    def __init__(self, error: Exception | None = None):
+        self.error = error
+        self.sent: list[tuple[list, str]] = []
+
+    async def __call__(self, call: Call, block_identifier):
+        self.sent.append(([data for _, data in call.encoded_data], block_identifier))
+        await asyncio.sleep(0)
+        if self.error:
+            raise self.error
+        return 100, [(True, data) for _, data in call.encoded_data]
+
+
+class TestCoalescer:
+    def test_merges_callers(self):
+        execute = _Execute()
+        coalescer = Coalescer(execute, 0.01, lambda: 100)
+
+        async def main():
+            return await asyncio.gather(
+                coalescer.submit(_call(1, 2), "latest", "latest"),
+                coalescer.submit(_call(3), "latest", "latest"),
+                coalescer.submit(_call(4), 10, "0xa"),
+            )
+
+        assert asyncio.run(main()) == [
+            (100, [(True, "0x1"), (True, "0x2")]),
+            (100, [(True, "0x3")]),
+            (100, [(True, "0x4")]),
+        ]
+        assert sorted(execute.sent, key=str) == [(["0x1", "0x2", "0x3"], "latest"), (["0x4"], 10)]
+        assert (coalescer.submitted, coalescer.sent) == (3, 2)
+
+    def test_max_calls(self):
+        execute = _Execute()
+        # window is never reached, full queues are sent at once
+        coalescer = Coalescer(execute, 10, lambda: 2)
+
+        async def main():
+            return await asyncio.wait_for(
+                asyncio.gather(*[coalescer.submit(_call(i), "latest", "latest") for i in range(4)]), 1
+            )
+
+        assert asyncio.run(main()) == [(100, [(True, hex(i))]) for i in range(4)]
+        assert [data for data, _ in execute.sent] == [["0x0", "0x1"], ["0x2", "0x3"]]
+
+    def test_error(self):
+        coalescer = Coalescer(_Execute(ValueError("failed")), 0.01, lambda: 100)
+
+        async def main():
+            return await asyncio.gather(
+                coalescer.submit(_call(1), "latest", "latest"),
+                coalescer.submit(_call(2), "latest", "latest"),
+                return_exceptions=True,
+            )
+
+        assert [str(result) for result in asyncio.run(main())] == ["failed", "failed"]
+
+    def test_cancelled_caller(self):
+        execute = _Execute()
+        coalescer = Coalescer(execute, 0.01, lambda: 100)
+
+        async def main():
+            cancelled = asyncio.ensure_future(coalescer.submit(_call(1), "latest", "latest"))
+            other = asyncio.ensure_future(coalescer.submit(_call(2), "latest", "latest"))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            return await other
+
+        assert asyncio.run(main()) == (100, [(True, "0x2")])
+        assert [data for data, _ in execute.sent] == [["0x1", "0x2"]]
+
+    def test_join(self):
+        call = Call.join([_call(1, 2), _call(3)])
+        assert [data for _, data in call.encoded_data] == ["0x1", "0x2", "0x3"]
+        assert len(call) == 3 and call.return_types == [["uint256"]] * 3
+
+    @pytest.mark.parametrize("window", (0, 0.01))
+    def test_single_caller(self, window):
+        execute = _Execute()
+        coalescer = Coalescer(execute, window, lambda: 100)
+        assert asyncio.run(coalescer.submit(_call(1), "latest", "latest")) == (100, [(True, "0x1")])
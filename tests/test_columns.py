@@ -0,0 +1,57 @@
+import pytest
+from eth_abi import encode
+
+from web3mc.columns import Columns, build_columns, check_columns
+
+np = pytest.importorskip("numpy")
+
+ADDRESS = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+
+
+class TestColumns:
+    def test_dtypes(self):
+        return_type = ["uint112", "uint32", "int24", "bool", "address", "bytes4", "uint256", "int256"]
+        values = [2**112 - 1, 2**32 - 1, -5, True, ADDRESS, b"\x01\x02\x03\x04", 2**256 - 1, -(2**255)]
+        columns = build_columns([(True, encode(return_type, values))], return_type)
+
+        assert [column.dtype for column in columns] == [
+            np.dtype(object),
+            np.dtype("uint32"),
+            np.dtype("int32"),
+            np.dtype(bool),
+            np.dtype("S20"),
+            np.dtype("S4"),
+            np.dtype(object),
+            np.dtype(object),
+        ]
+        assert [column[0] for column in columns] == values[:4] + [bytes.fromhex(ADDRESS[2:])] + values[5:]
+
+    def test_valid(self):
+        data = encode(["uint256", "bool"], [7, True])
+        results = [(True, data), (False, b""), (True, data + b"\x01" * 32), (True, data[:-1])]
+        columns = build_columns(results, ["uint256", "bool"])
+
+        assert columns.valid.tolist() == [True, False, True, False]
+        assert columns[0].tolist() == [7, 0, 7, 0]
+        assert columns[1].tolist() == [True, False, True, False]
+
+    def test_array(self):
+        data = encode(["uint64[2][3]"], [[[1, 2], [3, 4], [5, 6]]])
+        (column,) = build_columns([(True, data)] * 2, ["uint64[2][3]"])
+        assert column.shape == (2, 3, 2)
+        assert column[1].tolist() == [[1, 2], [3, 4], [5, 6]]
+
+    def test_stack(self):
+        blocks = [
+            build_columns([(True, encode(["uint8"], [block + i])) for i in range(3)] + [(False, b"")], ["uint8"])
+            for block in (10, 20)
+        ]
+        matrix = Columns.stack(blocks)
+        assert matrix[0].shape == (2, 4) and matrix[0].dtype == np.uint8
+        assert matrix[0].tolist() == [[10, 11, 12, 0], [20, 21, 22, 0]]
+        assert matrix.valid.tolist() == [[True, True, True, False]] * 2
+
+    @pytest.mark.parametrize("return_type", (["string"], ["uint256", "bytes"], ["(uint256,bool)"], ["uint256[]"]))
+    def test_unsupported(self, return_type):
+        with pytest.raises(ValueError):
+            check_columns(return_type)
@@ -0,0 +1,78 @@
+import pytest
+from eth_abi import encode
+from web3 import Web3
+
+from web3mc.encoding import (
+    AGGREGATE,
+    AGGREGATE3,
+    TRY_AGGREGATE,
+    decode_aggregate,
+    decode_compact,
+    decode_results,
+    encode_aggregate,
+    encode_aggregate3,
+    encode_compact,
+    encode_try_aggregate,
+)
+
+codec = Web3().codec
+
+CALL_DATA = [
+    ("0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2", "0x06fdde03"),
+    ("0x2260FAC5E5542a773Aa44fBCfeDf7C193bc2C599", "0x70a08231" + "00" * 32),
+    ("0x6B175474E89094C44Da98b954EedeAC495271d0F", "0x"),
+]
+RAW_CALL_DATA = [(target, bytes.fromhex(data[2:])) for target, data in CALL_DATA]
+
+
+class TestEncoding:
+    def test_aggregate(self):
+        assert encode_aggregate(CALL_DATA) == AGGREGATE + encode(["(address,bytes)[]"], [RAW_CALL_DATA])
+
+    @pytest.mark.parametrize("require_success", (True, False))
+    def test_try_aggregate(self, require_success):
+        assert encode_try_aggregate(require_success, CALL_DATA) == TRY_AGGREGATE + encode(
+            ["bool", "(address,bytes)[]"], [require_success, RAW_CALL_DATA]
+        )
+
+    def test_aggregate3(self):
+        allow_failure = [True, False, True]
+        calls = [(target, allow, data) for (target, data), allow in zip(RAW_CALL_DATA, allow_failure)]
+        assert encode_aggregate3(CALL_DATA, allow_failure) == AGGREGATE3 + encode(["(address,bool,bytes)[]"], [calls])
+
+    def test_empty(self):
+        assert encode_aggregate([]) == AGGREGATE + encode(["(address,bytes)[]"], [[]])
+
+    def test_decode_aggregate(self):
+        results = [b"", b"\x01" * 32, b"\x02" * 70]
+        data = encode(["uint256", "bytes[]"], [17_000_000, results])
+        assert decode_aggregate(data, codec) == [(True, result) for result in results]
+
+    def test_decode_results(self):
+        results = [(True, b"\x01" * 32), (False, b""), (True, b"\x02" * 70)]
+        assert decode_results(encode(["(bool,bytes)[]"], [results]), codec) == results
+
+    def test_decode_malformed(self):
+        data = encode(["(bool,bytes)[]"], [[(True, b"\x01" * 32)]])
+        with pytest.raises(Exception):
+            decode_results(data[:-32], codec)
+
+    def test_compact(self):
+        data = encode_compact(CALL_DATA, [0, 32, 64])
+        assert data[:4] == (3).to_bytes(4, "big")
+        assert data[4:24] == bytes.fromhex(CALL_DATA[0][0][2:])
+        assert data[24:29] == bytes(2) + (4).to_bytes(3, "big")
+        assert len(data) == 4 + 3 * 25 + 4 + 36
+
+    def test_decode_compact(self):
+        widths = [0, 32, 32] + [32] * 300
+        bitmap = (0b101 << 509 | 1 << 209).to_bytes(64, "big")
+        results = [(3).to_bytes(4, "big") + b"abc", (1).to_bytes(32, "big"), bytes(32)] + [bytes(32)] * 300
+        data = (17_000_000).to_bytes(32, "big") + bitmap + b"".join(results)
+
+        decoded = decode_compact(data, widths)
+        assert decoded[:3] == [(True, b"abc"), (False, (1).to_bytes(32, "big")), (True, bytes(32))]
+        assert [i for i, (success, _) in enumerate(decoded) if success] == [0, 2, 302]
+
+        with pytest.raises(ValueError):
+            decode_compact(data[:-1], widths)
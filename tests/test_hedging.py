@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from web3mc.hedging import HedgingPolicy
+
+
+class _Send:
+    """Requests returning their index after latencies[index], or failing with errors[index]"""
+
+    def __init__(self, latencies: list[float], errors: list[Exception | None] | None = None):
+        self.latencies = latencies
+        self.errors = errors or [None] * len(latencies)
+        self.sent = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        index = self.sent
+        self.sent += 1
+        try:
+            await asyncio.sleep(self.latencies[index])
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.errors[index]:
+            raise self.errors[index]
+        return index
+
+
+def _warm_up(policy: HedgingPolicy) -> None:
+    # deadline of 10ms, not moved by a few slower requests
+    for _ in range(1000):
+        policy.observe(0.01)
+
+
+class TestHedgingPolicy:
+    def test_deadline(self):
+        policy = HedgingPolicy(percentile=0.9, min_delay=0.001)
+        assert policy.deadline is None
+
+        for latency in range(1, 101):
+            policy.observe(latency / 1000)
+        assert policy.deadline == pytest.approx(0.09, abs=0.002)
+
+        # floored at min_delay
+        policy = HedgingPolicy(min_delay=1.0)
+        _warm_up(policy)
+        assert policy.deadline == 1.0
+
+    def test_hedge_wins(self):
+        policy = HedgingPolicy(budget=1.0)
+        _warm_up(policy)
+        send = _Send([1.0, 0.0])
+
+        # primary is slow, hedge sent after 10ms returns first and primary is cancelled
+        assert asyncio.run(policy.run(send)) == 1
+        assert (send.sent, send.cancelled) == (2, 1)
+        assert (policy.requests, policy.hedged, policy.won) == (1, 1, 1)
+
+    def test_fast_not_hedged(self):
+        policy = HedgingPolicy(budget=1.0)
+        _warm_up(policy)
+        send = _Send([0.0])
+
+        assert asyncio.run(policy.run(send)) == 0
+        assert send.sent == 1
+        assert (policy.hedged, policy.won) == (0, 0)
+
+    def test_budget(self):
+        policy = HedgingPolicy(budget=0.25)
+        _warm_up(policy)
+        send = _Send([0.03] * 100)
+
+        async def main():
+            for _ in range(8):
+                await policy.run(send)
+
+        asyncio.run(main())
+        assert policy.requests == 8
+        assert policy.hedged == 2
+        assert send.sent == 10
+
+    def test_error(self):
+        policy = HedgingPolicy(budget=1.0)
+        _warm_up(policy)
+
+        # hedge failing doesn't fail the request
+        send = _Send([0.03, 0.0], [None, ValueError("hedge failed")])
+        assert asyncio.run(policy.run(send)) == 0
+        assert (policy.hedged, policy.won) == (1, 0)
+
+        # error of primary is raised if both fail
+        send = _Send([0.03, 0.0], [ValueError("primary failed"), ValueError("hedge failed")])
+        with pytest.raises(ValueError, match="primary failed"):
+            asyncio.run(policy.run(send))
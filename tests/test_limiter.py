@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from web3mc.limiter import ConcurrencyLimiter
+
+
+async def _run(limiter: ConcurrencyLimiter, n: int, delay: float = 0.01, counter: dict | None = None) -> int:
+    counter = {"in_flight": 0, "max": 0} if counter is None else counter
+
+    async def job():
+        async with limiter:
+            counter["in_flight"] += 1
+            counter["max"] = max(counter["max"], counter["in_flight"])
+            await asyncio.sleep(delay)
+            counter["in_flight"] -= 1
+
+    await asyncio.gather(*[job() for _ in range(n)])
+    return counter["max"]
+
+
+class TestConcurrencyLimiter:
+    @pytest.mark.parametrize("limit", (1, 3, 10))
+    def test_limit(self, limit):
+        limiter = ConcurrencyLimiter(limit)
+        assert asyncio.run(_run(limiter, 30)) == limit
+        assert limiter.in_flight == 0
+        assert limiter.queued == 0
+
+    def test_shared_between_callers(self):
+        limiter = ConcurrencyLimiter(4)
+
+        counter = {"in_flight": 0, "max": 0}
+
+        async def main():
+            await asyncio.gather(_run(limiter, 10, counter=counter), _run(limiter, 10, counter=counter))
+
+        asyncio.run(main())
+        assert counter["max"] == 4
+
+    def test_fifo(self):
+        limiter = ConcurrencyLimiter(1)
+        order = []
+
+        async def job(i):
+            async with limiter:
+                order.append(i)
+                await asyncio.sleep(0)
+
+        async def main():
+            await asyncio.gather(*[job(i) for i in range(10)])
+
+        asyncio.run(main())
+        assert order == list(range(10))
+
+    def test_cancelled_waiter(self):
+        limiter = ConcurrencyLimiter(1)
+
+        async def main():
+            await limiter.acquire()
+            waiter = asyncio.create_task(limiter.acquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            limiter.release()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+            assert limiter.in_flight == 0
+            return await _run(limiter, 5)
+
+        assert asyncio.run(main()) == 1
+
+    def test_resize(self):
+        limiter = ConcurrencyLimiter(1)
+
+        async def main():
+            task = asyncio.create_task(_run(limiter, 20))
+            await asyncio.sleep(0.005)
+            limiter.limit = 5
+            return await task
+
+        assert asyncio.run(main()) == 5
+
+    def test_invalid_limit(self):
+        with pytest.raises(ValueError):
+            ConcurrencyLimiter(0)
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from web3mc.loop import LoopThread
+
+
+async def _loop() -> asyncio.AbstractEventLoop:
+    return asyncio.get_running_loop()
+
+
+class TestLoopThread:
+    def test_reuses_loop(self):
+        loop_thread = LoopThread()
+        loop = loop_thread.run(_loop())
+        assert loop_thread.run(_loop()) is loop
+        assert loop.is_running()
+
+        loop_thread.close()
+        assert loop_thread.run(_loop()) is not loop
+        loop_thread.close()
+
+    def test_exception(self):
+        loop_thread = LoopThread()
+
+        async def fail():
+            raise ValueError("failed")
+
+        with pytest.raises(ValueError, match="failed"):
+            loop_thread.run(fail())
+        assert loop_thread.run(asyncio.sleep(0, "ok")) == "ok"
+        loop_thread.close()
+
+    def test_inside_running_loop(self):
+        loop_thread = LoopThread()
+
+        async def main():
+            return loop_thread.run(_loop()) is not asyncio.get_running_loop()
+
+        assert asyncio.run(main())
+
+        async def nested():
+            return loop_thread.run(_loop())
+
+        with pytest.raises(RuntimeError):
+            loop_thread.run(nested())
+        loop_thread.close()
+
+    def test_async_generator(self):
+        loop_thread = LoopThread()
+
+        async def numbers():
+            for i in range(3):
+                yield i
+
+        iterator = numbers()
+        assert [loop_thread.run(iterator.__anext__()) for _ in range(3)] == [0, 1, 2]
+        with pytest.raises(StopAsyncIteration):
+            loop_thread.run(iterator.__anext__())
+        loop_thread.close()
@@ -0,0 +1,83 @@
+import pytest
+
+from web3mc.planner import (
+    CALL_OVERHEAD,
+    DEFAULT_CALL_GAS,
+    BatchPlanner,
+    estimate_return_size,
+    is_out_of_gas,
+    is_response_too_large,
+)
+
+ADDRESS = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+BALANCE_OF = "0x70a08231" + "00" * 32
+NAME = "0x06fdde03"
+
+
+class TestBatchPlanner:
+    @pytest.mark.parametrize("max_calls", (1, 3, 10, 100))
+    def test_max_calls(self, max_calls):
+        planner = BatchPlanner()
+        batches = planner.plan([(ADDRESS, BALANCE_OF)] * 25, [["uint256"]] * 25, max_calls, 15_000_000)
+
+        assert batches[0] == (0, min(max_calls, 25))
+        assert batches[-1][1] == 25
+        assert all(j - i <= max_calls for i, j in batches)
+        assert all(batches[k][1] == batches[k + 1][0] for k in range(len(batches) - 1))
+
+    def test_gas_limit(self):
+        planner = BatchPlanner()
+        batches = planner.plan([(ADDRESS, BALANCE_OF)] * 25, [["uint256"]] * 25, 100, 10 * DEFAULT_CALL_GAS)
+
+        assert batches == [(0, 10), (10, 20), (20, 25)]
+
+    def test_calldata_bytes(self):
+        planner = BatchPlanner(max_calldata_bytes=5 * (CALL_OVERHEAD + 64))
+        batches = planner.plan([(ADDRESS, BALANCE_OF)] * 10, [["uint256"]] * 10, 100, 15_000_000)
+
+        assert batches == [(0, 5), (5, 10)]
+
+    def test_learn_return_size(self):
+        planner = BatchPlanner(max_return_bytes=10_000)
+        call_data, return_types = [(ADDRESS, NAME)] * 100, [["string"]] * 100
+
+        assert len(planner.plan(call_data, return_types, 100, 15_000_000)) == 4
+        planner.observe(call_data[:1], [b"\x00" * 96])
+        assert len(planner.plan(call_data, return_types, 100, 15_000_000)) == 2
+
+    def test_out_of_gas(self):
+        planner = BatchPlanner()
+        call_data = [(ADDRESS, BALANCE_OF)] * 10
+
+        planner.out_of_gas(call_data, 10 * DEFAULT_CALL_GAS)
+        assert planner.gas[BALANCE_OF[:10]] == 2 * DEFAULT_CALL_GAS
+        assert planner.plan(call_data, [["uint256"]] * 10, 100, 10 * DEFAULT_CALL_GAS) == [(0, 5), (5, 10)]
+
+        # same batch failing again concurrently doesn't raise estimates further
+        planner.out_of_gas(call_data, 10 * DEFAULT_CALL_GAS)
+        assert planner.gas[BALANCE_OF[:10]] == 2 * DEFAULT_CALL_GAS
+
+    def test_response_too_large(self):
+        planner = BatchPlanner()
+        call_data, return_types = [(ADDRESS, BALANCE_OF)] * 10, [["uint256"]] * 10
+
+        planner.response_too_large(call_data, return_types)
+        planner.response_too_large(call_data, return_types)
+        assert planner.plan(call_data, return_types, 100, 15_000_000) == [(0, 5), (5, 10)]
+
+    def test_single_call(self):
+        planner = BatchPlanner(max_calldata_bytes=1, max_return_bytes=1)
+        assert planner.plan([(ADDRESS, BALANCE_OF)] * 2, [["uint256"]] * 2, 100, 1) == [(0, 1), (1, 2)]
+        assert planner.plan([], [], 100, 1) == []
+
+    @pytest.mark.parametrize(
+        "return_type,size",
+        ((["uint256"], 32), (["uint256[4]"], 128), (["(uint256,address)[2]"], 128), (["uint256", "string"], 288)),
+    )
+    def test_estimate_return_size(self, return_type, size):
+        assert estimate_return_size(tuple(return_type)) == size
+
+    def test_errors(self):
+        assert is_out_of_gas(ValueError({"code": -32000, "message": "out of gas"}))
+        assert is_response_too_large(ValueError({"code": -32000, "message": "response size exceeded"}))
+        assert not is_out_of_gas(ValueError({"code": -32000, "message": "header not found"}))
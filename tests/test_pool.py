@@ -0,0 +1,127 @@
+import asyncio
+import random
+import time
+from unittest.mock import patch
+
+import pytest
+from aiohttp import ClientConnectionError
+from web3.exceptions import ContractLogicError
+
+from web3mc.pool import ProviderPool
+
+
+class _Transport:
+    def __init__(self, url: str, latency: float = 0.0, error: Exception | None = None):
+        self.endpoint_uri = url
+        self.latency = latency
+        self.error = error
+        self.requests = 0
+
+    async def request(self, method: str, params: list):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self.error:
+            raise self.error
+        return self.endpoint_uri
+
+
+def _run(pool: ProviderPool, n: int) -> list:
+    async def main():
+        return [await pool.request("eth_call", []) for _ in range(n)]
+
+    return asyncio.run(main())
+
+
+class TestProviderPool:
+    def test_weighted_by_latency(self):
+        fast, slow = _Transport("fast"), _Transport("slow", latency=0.02)
+        pool = ProviderPool([fast, slow])
+
+        with patch("web3mc.pool.random", random.Random(0)):
+            results = _run(pool, 100)
+
+        assert results.count("fast") > 80
+        assert slow.requests > 0
+
+    def test_redispatch(self):
+        broken = _Transport("broken", error=ClientConnectionError("refused"))
+        pool = ProviderPool([broken, _Transport("good")], failure_threshold=3)
+
+        assert _run(pool, 20) == ["good"] * 20
+        # ejected after 3 failures
+        assert broken.requests == 3
+        assert pool.redispatched == 3
+        assert pool.endpoints[0].state == "open"
+
+    def test_revert_not_redispatched(self):
+        transports = [_Transport(str(i), error=ContractLogicError("execution reverted")) for i in range(2)]
+        pool = ProviderPool(transports)
+
+        with pytest.raises(ContractLogicError):
+            _run(pool, 1)
+        assert sum(transport.requests for transport in transports) == 1
+        assert all(endpoint.failures == 0 for endpoint in pool.endpoints)
+
+    def test_circuit_breaker(self):
+        transport = _Transport("flaky", error=ClientConnectionError("refused"))
+        pool = ProviderPool([transport, _Transport("good")], failure_threshold=1, cooldown=0.05)
+        endpoint = pool.endpoints[0]
+
+        _run(pool, 10)
+        assert endpoint.state == "open"
+        requests = transport.requests
+
+        # failed trial opens circuit for twice as long
+        time.sleep(0.06)
+        assert endpoint.state == "half-open"
+        _run(pool, 10)
+        assert transport.requests == requests + 1
+        assert endpoint.state == "open" and endpoint.cooldown == 0.1
+
+        transport.error = None
+        time.sleep(0.11)
+        _run(pool, 10)
+        assert endpoint.state == "closed" and endpoint.cooldown == 0.05
+
+    def test_tried(self):
+        pool = ProviderPool([_Transport("0"), _Transport("1")])
+
+        async def main(tried):
+            return await asyncio.gather(*[pool.request("eth_call", [], tried) for _ in range(2)])
+
+        # duplicates sharing tried endpoints go to different endpoints, then to available ones
+        for _ in range(10):
+            assert sorted(asyncio.run(main([]))) == ["0", "1"]
+        assert asyncio.run(main(pool.endpoints[:1]))[0] == "1"
+        assert asyncio.run(main(pool.endpoints[:]))[0] in ("0", "1")
+
+    def test_all_ejected(self):
+        transports = [_Transport(str(i), error=ClientConnectionError("refused")) for i in range(2)]
+        pool = ProviderPool(transports, failure_threshold=1)
+
+        for _ in range(3):
+            with pytest.raises(ClientConnectionError):
+                _run(pool, 1)
+        assert [endpoint.state for endpoint in pool.endpoints] == ["open", "open"]
+
+        for transport in transports:
+            transport.error = None
+        # an ejected endpoint is still tried instead of failing
+        assert _run(pool, 1)[0] in ("0", "1")
+        assert "closed" in [endpoint.state for endpoint in pool.endpoints]
+
+    def test_tuned_per_endpoint(self):
+        limited = _Transport("limited", error=ValueError({"code": 429, "message": "Too Many Requests"}))
+        transports = [limited, _Transport("1"), _Transport("2")]
+        pool = ProviderPool(transports, concurrency=64, tune_batch=100)
+        assert pool.batch == 100
+
+        # first choice is the rate limited endpoint, requests are sent again to the others
+        with patch("web3mc.pool.random.choices", lambda candidates, weights: candidates[:1]):
+            assert set(_run(pool, 20)) == {"1"}
+        assert limited.requests == 5 and pool.redispatched == 5
+
+        # only concurrency of the rate limited endpoint is lowered
+        assert pool.endpoints[0].tuner.concurrency < 16 and pool.endpoints[0].limiter.limit < 16
+        assert all(endpoint.tuner.concurrency >= 16 for endpoint in pool.endpoints[1:])
+        assert pool.endpoints[1].limiter.limit >= 16
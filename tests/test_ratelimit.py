@@ -0,0 +1,78 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from web3mc.ratelimit import RateLimit, TokenBucket, parse_retry_after
+
+
+class TestTokenBucket:
+    def test_reserve(self):
+        bucket = TokenBucket(100, 2)
+
+        # burst of capacity, then spaced by 1 / rate
+        delays = [bucket.reserve(1) for _ in range(5)]
+        assert delays[:2] == [0, 0]
+        assert delays[2:] == pytest.approx([0.01, 0.02, 0.03], abs=0.002)
+
+    def test_large_cost(self):
+        bucket = TokenBucket(100, 2)
+        assert bucket.reserve(10) == pytest.approx(0.08, abs=0.002)
+        assert bucket.reserve(1) == pytest.approx(0.09, abs=0.002)
+
+    def test_pause(self):
+        bucket = TokenBucket(100, 2)
+        bucket.pause(0.5)
+
+        # starts empty after pause
+        assert bucket.reserve(1) == pytest.approx(0.51, abs=0.002)
+        time.sleep(0.05)
+        assert bucket.reserve(1) == pytest.approx(0.47, abs=0.005)
+
+
+class TestRateLimit:
+    def test_requests_per_second(self):
+        rate_limit = RateLimit(100, burst=0)
+
+        async def main():
+            await asyncio.gather(*[rate_limit.acquire("eth_call", []) for _ in range(20)])
+
+        start = time.monotonic()
+        asyncio.run(main())
+        assert 0.18 <= time.monotonic() - start < 0.5
+        assert rate_limit.delayed == 19
+
+    def test_compute_units(self):
+        # eth_call costs 10 units, others 1
+        rate_limit = RateLimit(1000, 500, weight=lambda method, params: 10 if method == "eth_call" else 1, burst=0)
+
+        async def main(method):
+            await asyncio.gather(*[rate_limit.acquire(method, []) for _ in range(10)])
+
+        start = time.monotonic()
+        asyncio.run(main("eth_chainId"))
+        assert time.monotonic() - start < 0.05
+        asyncio.run(main("eth_call"))
+        assert time.monotonic() - start >= 0.18
+
+    @pytest.mark.parametrize(
+        "headers,delay",
+        (
+            ({"Retry-After": "2"}, 2),
+            ({"Retry-After": "0.5"}, 0.5),
+            ({"Retry-After": "soon"}, None),
+            ({}, None),
+            (None, None),
+        ),
+    )
+    def test_parse_retry_after(self, headers, delay):
+        if delay is None:
+            assert parse_retry_after(headers) is None
+        else:
+            assert parse_retry_after(headers) == delay
+
+    def test_parse_retry_after_date(self):
+        date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+        assert 58 <= parse_retry_after({"Retry-After": date}) <= 60
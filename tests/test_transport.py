@@ -0,0 +1,132 @@
+import asyncio
+import json
+import time
+
+import pytest
+from aiohttp import ClientResponseError, web
+from hexbytes import HexBytes
+from web3 import AsyncHTTPProvider
+from web3.exceptions import ContractLogicError
+
+from web3mc.ratelimit import RateLimit
+from web3mc.transport import RPCTransport, format_block_identifier
+
+
+class _Server:
+    """JSON-RPC server echoing params of eth_call requests"""
+
+    def __init__(self, accept_batch: bool = True, rate_limited: int = 0):
+        self.accept_batch = accept_batch
+        # number of posts answered with 429
+        self.rate_limited = rate_limited
+        self.posts = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = json.loads(await request.read())
+        self.posts.append(body)
+        if self.rate_limited:
+            self.rate_limited -= 1
+            return web.Response(status=429, headers={"Retry-After": "0.2"})
+        if isinstance(body, list):
+            if not self.accept_batch:
+                return web.json_response({"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": "no"}})
+            return web.json_response([self.respond(item) for item in reversed(body)])
+        return web.json_response(self.respond(body))
+
+    @staticmethod
+    def respond(request: dict) -> dict:
+        if request["params"][0] == "revert":
+            return {"jsonrpc": "2.0", "id": request["id"], "error": {"code": 3, "message": "execution reverted"}}
+        return {"jsonrpc": "2.0", "id": request["id"], "result": request["params"][0]}
+
+
+async def _run(server: _Server, max_batch_bytes: int | None, params: list, rate_limit: RateLimit | None = None):
+    app = web.Application()
+    app.router.add_post("/", server.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    transport = RPCTransport(AsyncHTTPProvider(f"http://127.0.0.1:{port}"), max_batch_bytes, rate_limit)
+    try:
+        return transport, await asyncio.gather(
+            *[transport.request("eth_call", [param]) for param in params], return_exceptions=True
+        )
+    finally:
+        await runner.cleanup()
+
+
+class TestRPCTransport:
+    def test_single(self):
+        server = _Server()
+        _, results = asyncio.run(_run(server, None, ["a", "b", "c"]))
+
+        assert results == ["a", "b", "c"]
+        assert len(server.posts) == 3
+
+    def test_batch(self):
+        server = _Server()
+        _, results = asyncio.run(_run(server, 1_000_000, [f"{i}" for i in range(50)]))
+
+        assert results == [f"{i}" for i in range(50)]
+        assert len(server.posts) == 1
+
+    @pytest.mark.parametrize("max_batch_bytes", (1, 200, 1000))
+    def test_batch_bytes(self, max_batch_bytes):
+        server = _Server()
+        _, results = asyncio.run(_run(server, max_batch_bytes, [f"{i}" for i in range(50)]))
+
+        assert results == [f"{i}" for i in range(50)]
+        batches = [post for post in server.posts if isinstance(post, list)]
+        assert all(sum(len(json.dumps(request)) + 1 for request in batch) <= max_batch_bytes for batch in batches)
+
+    def test_error(self):
+        server = _Server()
+        _, results = asyncio.run(_run(server, 1_000_000, ["a", "revert", "c"]))
+
+        assert results[0] == "a" and results[2] == "c"
+        assert isinstance(results[1], ContractLogicError)
+
+    def test_batch_rejected(self):
+        server = _Server(accept_batch=False)
+        transport, results = asyncio.run(_run(server, 1_000_000, ["a", "b", "c"]))
+
+        assert results == ["a", "b", "c"]
+        assert not transport.batching
+        assert len(server.posts) == 4
+
+    def test_rate_limit(self):
+        server = _Server()
+        start = time.monotonic()
+        _, results = asyncio.run(_run(server, 1_000_000, [f"{i}" for i in range(10)], RateLimit(50, burst=0)))
+
+        assert results == [f"{i}" for i in range(10)]
+        # requests are spaced evenly, so they aren't sent in one batch
+        assert time.monotonic() - start >= 0.18
+        assert len(server.posts) > 5
+
+    def test_retry_after(self):
+        server = _Server(rate_limited=1)
+        rate_limit = RateLimit(1000)
+        _, results = asyncio.run(_run(server, None, ["a"], rate_limit))
+        assert isinstance(results[0], ClientResponseError) and results[0].status == 429
+        assert rate_limit.pauses == 1
+
+        start = time.monotonic()
+        _, results = asyncio.run(_run(server, None, ["a"], rate_limit))
+        assert results == ["a"]
+        assert time.monotonic() - start >= 0.15
+
+    @pytest.mark.parametrize(
+        "block_identifier,formatted",
+        (
+            (17_000_000, "0x1036640"),
+            ("latest", "latest"),
+            (b"\x01" * 2, "0x0101"),
+            (HexBytes(b"\x01" * 2), "0x0101"),
+        ),
+    )
+    def test_format_block_identifier(self, block_identifier, formatted):
+        assert format_block_identifier(block_identifier) == formatted
@@ -0,0 +1,75 @@
+import asyncio
+
+from aiohttp import ClientResponseError
+
+from web3mc.limiter import ConcurrencyLimiter
+from web3mc.tuner import AutoTuner, is_rate_limited, is_timeout
+
+
+def _rate_limited() -> ClientResponseError:
+    return ClientResponseError(None, (), status=429)
+
+
+class TestAutoTuner:
+    def test_initial(self):
+        limiter = ConcurrencyLimiter(100)
+        tuner = AutoTuner(limiter, 100)
+
+        assert tuner.settings == {"batch": 100, "concurrency": 16}
+        assert limiter.limit == 16
+
+    def test_additive_increase(self):
+        limiter = ConcurrencyLimiter(100)
+        tuner = AutoTuner(limiter, 100, concurrency=4)
+
+        # about one step per round of concurrent requests
+        for _ in range(4):
+            tuner.success(tuner.epoch, 0.1)
+        assert tuner.concurrency == 4
+        assert 105 < tuner.batch < 110
+
+        for _ in range(4):
+            tuner.success(tuner.epoch, 0.1)
+        assert tuner.concurrency == 5
+        assert limiter.limit == 5
+
+    def test_bounds(self):
+        tuner = AutoTuner(ConcurrencyLimiter(8), 10, max_batch=20)
+
+        for _ in range(1000):
+            tuner.success(tuner.epoch, 0.1)
+        assert tuner.settings == {"batch": 20, "concurrency": 8}
+
+        for _ in range(100):
+            tuner.failure(tuner.epoch, asyncio.TimeoutError())
+        assert tuner.settings == {"batch": 1, "concurrency": 1}
+
+    def test_multiplicative_decrease(self):
+        limiter = ConcurrencyLimiter(100)
+        tuner = AutoTuner(limiter, 100)
+
+        tuner.failure(tuner.epoch, _rate_limited())
+        assert tuner.settings == {"batch": 100, "concurrency": 8}
+        assert limiter.limit == 8
+
+        tuner.failure(tuner.epoch, ValueError({"code": -32000, "message": "out of gas"}))
+        assert tuner.settings == {"batch": 50, "concurrency": 8}
+
+        tuner.success(tuner.epoch, 10.0)
+        assert tuner.settings == {"batch": 50, "concurrency": 4}
+
+    def test_decrease_once_per_round(self):
+        tuner = AutoTuner(ConcurrencyLimiter(100), 100)
+        epoch = tuner.epoch
+
+        # concurrent requests sent before the decrease are rate limited too
+        for _ in range(10):
+            tuner.failure(epoch, _rate_limited())
+        assert tuner.concurrency == 8
+
+    def test_errors(self):
+        assert is_rate_limited(_rate_limited())
+        assert is_rate_limited(ValueError({"code": -32005, "message": "rate limit exceeded"}))
+        assert not is_rate_limited(ValueError({"code": -32000, "message": "out of gas"}))
+        assert is_timeout(asyncio.TimeoutError())
+        assert not is_timeout(ValueError({"code": 3, "message": "execution reverted"}))
@@ -1,3 +1,7 @@
+from .cache import ResultCache
+from .call import Call, CallTemplate, SignatureCall
+from .hedging import HedgingPolicy
 from .multicall import Multicall
+from .ratelimit import RateLimit
 
-__all__ = ["Multicall"]
+__all__ = ["Call", "CallTemplate", "HedgingPolicy", "Multicall", "RateLimit", "ResultCache", "SignatureCall"]
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+from eth_typing import ChecksumAddress, HexStr
+
+# approximate memory used by an entry besides its calldata and return data
+ENTRY_OVERHEAD = 200
+# number of recent block hashes kept per chain to detect reorgs
+MAX_BLOCK_HASHES = 1024
+
+
+class ResultCache:
+    """
+    LRU cache of return data of successful calls per (chain id, block, target, calldata), limited by approximate size
+    of entries in bytes. Can be shared by Multicall instances.
+
+    Blocks are keyed by number once they are more than confirmations blocks behind the latest seen head, recent blocks
+    (and latest) are keyed by their hash, so results of blocks replaced by a reorg are never returned. Entries of a
+    replaced block hash are dropped as soon as the new hash of its number is seen. A head older than head_ttl seconds
+    is requested again before a block is found to be recent.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2**20, confirmations: int = 64, head_ttl: float = 12.0):
+        self.max_bytes = max_bytes
+        self.confirmations = confirmations
+        self.head_ttl = head_ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[tuple, bytes] = OrderedDict()
+        # head of chain and time it was seen
+        self._heads: dict[int, tuple[int, float]] = {}
+        self._hashes: dict[int, OrderedDict[int, bytes]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def is_final(self, chain_id: int, number: int) -> bool:
+        """Whether block is deep enough behind the latest seen head to be keyed by number"""
+        head = self._heads.get(chain_id)
+        return head is not None and number <= head[0] - self.confirmations
+
+    def head_expired(self, chain_id: int) -> bool:
+        """Whether head of chain is unknown or was seen more than head_ttl seconds ago"""
+        head = self._heads.get(chain_id)
+        return head is None or time.monotonic() - head[1] >= self.head_ttl
+
+    def set_head(self, chain_id: int, number: int) -> None:
+        """Records head of chain, a lower head (of a lagging provider) doesn't replace a higher one"""
+        with self._lock:
+            head = self._heads.get(chain_id)
+            self._heads[chain_id] = (number if head is None else max(number, head[0]), time.monotonic())
+
+    def set_block(self, chain_id: int, number: int, block_hash: bytes, latest: bool = False) -> None:
+        """Records hash of block number (and head of chain if block is latest), drops entries of replaced hash"""
+        if latest:
+            self.set_head(chain_id, number)
+        with self._lock:
+            hashes = self._hashes.setdefault(chain_id, OrderedDict())
+            replaced = hashes.pop(number, None)
+            hashes[number] = block_hash
+            if len(hashes) > MAX_BLOCK_HASHES:
+                hashes.popitem(last=False)
+
+            if replaced is not None and replaced != block_hash:
+                for key in [key for key in self._entries if key[:2] == (chain_id, replaced)]:
+                    self._remove(key)
+
+    def get(
+        self, chain_id: int, block: int | bytes, call_data: list[tuple[ChecksumAddress, HexStr]]
+    ) -> list[bytes | None]:
+        """:return: cached return data of calls, None for calls that aren't cached"""
+        output = []
+        with self._lock:
+            for address, data in call_data:
+                key = (chain_id, block, address.lower(), data)
+                result = self._entries.get(key)
+                if result is not None:
+                    self._entries.move_to_end(key)
+                output.append(result)
+        hits = sum(result is not None for result in output)
+        self.hits += hits
+        self.misses += len(output) - hits
+        return output
+
+    def put(
+        self,
+        chain_id: int,
+        block: int | bytes,
+        call_data: list[tuple[ChecksumAddress, HexStr]],
+        results: list[tuple[bool, bytes]],
+    ) -> None:
+        """Stores return data of successful calls"""
+        with self._lock:
+            for (address, data), result in zip(call_data, results):
+                if not isinstance(result, tuple) or not result[0]:
+                    continue
+                key = (chain_id, block, address.lower(), data)
+                if key in self._entries:
+                    self._remove(key)
+                self._entries[key] = bytes(result[1])
+                self.size += self._entry_size(key, self._entries[key])
+
+            while self.size > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key: tuple) -> None:
+        # must be called with the lock held
+        self.size -= self._entry_size(key, self._entries.pop(key))
+
+    @staticmethod
+    def _entry_size(key: tuple, result: bytes) -> int:
+        return ENTRY_OVERHEAD + len(key[3]) + len(result)
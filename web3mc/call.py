@@ -1,21 +1,71 @@
 import logging
-from functools import cached_property
-from typing import Any
+from functools import cached_property, lru_cache
+from typing import Any, Callable, Iterable, Sequence
 
 from eth_abi.codec import ABICodec
 from eth_abi.exceptions import DecodingError
+from eth_abi.grammar import ABIType, BasicType, TupleType, parse
 from eth_typing import ChecksumAddress, HexStr
+from eth_utils import function_signature_to_4byte_selector, to_checksum_address
+from web3._utils.abi import build_strict_registry, filter_by_name, get_abi_input_types
+from web3._utils.normalizers import abi_address_to_hex, abi_bytes_to_bytes, abi_string_to_text
 from web3.contract.contract import ContractFunction
 from web3.contract.utils import BASE_RETURN_NORMALIZERS, get_abi_output_types, map_abi_data
 
 logger = logging.getLogger(__name__)
 
+# same codec and argument normalizers as web3 contract functions use for encoding
+_codec = ABICodec(build_strict_registry())
+_INPUT_NORMALIZERS = [abi_bytes_to_bytes, abi_string_to_text, abi_address_to_hex]
+
 
 class Call:
-    def __init__(self, calls: list[ContractFunction], addresses: list[ChecksumAddress] | None):
+    def __init__(self, calls: list["ContractFunction | SignatureCall"], addresses: list[ChecksumAddress] | None):
         self.calls = calls
         self.addresses = addresses
 
+    @classmethod
+    def from_template(
+        cls,
+        template: "CallTemplate",
+        args: Iterable[Sequence[Any]],
+        addresses: ChecksumAddress | list[ChecksumAddress],
+    ) -> "Call":
+        """
+        Calls of a single function encoded in bulk, without ContractFunction objects
+
+        :param template: function to call
+        :param args: arguments of every call
+        :param addresses: target address of every call or a single address for all calls
+        """
+        encoded_data = template.encode_many(args)
+        if isinstance(addresses, str):
+            addresses = [addresses] * len(encoded_data)
+        assert len(addresses) == len(encoded_data), "Lists of addresses and arguments should have same length."
+
+        call = cls([], list(addresses))
+        call.encoded_data = list(zip(addresses, encoded_data))
+        call.return_types = [template.return_types] * len(encoded_data)
+        return call
+
+    @classmethod
+    def join(cls, calls: list["Call"]) -> "Call":
+        """Calls of all given Calls, in order"""
+        call = cls([], None)
+        call.encoded_data = [data for item in calls for data in item.encoded_data]
+        call.return_types = [return_type for item in calls for return_type in item.return_types]
+        return call
+
+    def subset(self, indexes: list[int]) -> "Call":
+        """Calls at given indexes"""
+        call = type(self)([], None)
+        call.encoded_data = [self.encoded_data[i] for i in indexes]
+        call.return_types = [self.return_types[i] for i in indexes]
+        return call
+
+    def __len__(self) -> int:
+        return len(self.encoded_data)
+
     @cached_property
     def encoded_data(self) -> list[tuple[ChecksumAddress, HexStr]]:
         if self.addresses:
@@ -24,10 +74,120 @@ class Call:
 
     @cached_property
     def return_types(self) -> list[list[str]]:
-        return [get_abi_output_types(call.abi) for call in self.calls]
+        return [
+            call.template.return_types if isinstance(call, SignatureCall) else get_abi_output_types(call.abi)
+            for call in self.calls
+        ]
+
+
+@lru_cache(maxsize=2**16)
+def _checksum_address(value: bytes) -> ChecksumAddress:
+    return to_checksum_address(value)
+
+
+def _word_decoder(abi_type: BasicType) -> Callable[[bytes], Any] | None:
+    # decoders of single word types, raise ValueError if padding is invalid (data is decoded by codec then)
+    if abi_type.base == "uint":
+        bits = abi_type.sub
+
+        def decode(word: bytes) -> int:
+            value = int.from_bytes(word, "big")
+            if value >> bits:
+                raise ValueError("Invalid padding")
+            return value
+
+    elif abi_type.base == "int":
+        bound = 2 ** (abi_type.sub - 1)
+
+        def decode(word: bytes) -> int:
+            value = int.from_bytes(word, "big", signed=True)
+            if not -bound <= value < bound:
+                raise ValueError("Invalid padding")
+            return value
+
+    elif abi_type.base == "address":
+
+        def decode(word: bytes) -> ChecksumAddress:
+            if any(word[:12]):
+                raise ValueError("Invalid padding")
+            return _checksum_address(bytes(word[12:]))
+
+    elif abi_type.base == "bool":
+
+        def decode(word: bytes) -> bool:
+            value = int.from_bytes(word, "big")
+            if value > 1:
+                raise ValueError("Invalid padding")
+            return value == 1
+
+    elif abi_type.base == "bytes" and abi_type.sub is not None:
+        size = abi_type.sub
+
+        def decode(word: bytes) -> bytes:
+            if any(word[size:]):
+                raise ValueError("Invalid padding")
+            return bytes(word[:size])
+
+    else:
+        return None
+    return decode
+
+
+def _static_decoder(abi_type: ABIType) -> tuple[int, Callable[[bytes, int], Any]] | None:
+    # returns size of type and decoder of value at offset, None for dynamic and unsupported types
+    if abi_type.is_dynamic:
+        return None
+
+    if abi_type.is_array:
+        item = _static_decoder(abi_type.item_type)
+        if item is None:
+            return None
+        item_size, decode_item = item
+        length = abi_type.arrlist[-1][0]
+        return item_size * length, lambda data, offset: [
+            decode_item(data, offset + i * item_size) for i in range(length)
+        ]
+
+    if isinstance(abi_type, TupleType):
+        components = _static_decoders(abi_type.components)
+        if components is None:
+            return None
+        size, decoders = components
+        return size, lambda data, offset: tuple(decode(data, offset + position) for position, decode in decoders)
+
+    decode_word = _word_decoder(abi_type)
+    if decode_word is None:
+        return None
+    return 32, lambda data, offset: decode_word(data[offset : offset + 32])
+
+
+def _static_decoders(abi_types) -> tuple[int, list[tuple[int, Callable[[bytes, int], Any]]]] | None:
+    size, decoders = 0, []
+    for abi_type in abi_types:
+        decoder = _static_decoder(abi_type)
+        if decoder is None:
+            return None
+        decoders.append((size, decoder[1]))
+        size += decoder[0]
+    return size, decoders
+
+
+@lru_cache(maxsize=None)
+def _compile_decoder(return_type: tuple[str, ...]) -> tuple[int, list[tuple[int, Callable[[bytes, int], Any]]]] | None:
+    return _static_decoders([parse(abi_type) for abi_type in return_type])
 
 
 def decode_return_data(return_data: bytes | bytearray, return_type: list[str], codec: ABICodec) -> Any | None:
+    # static types are sliced directly with decoders compiled per return type, the rest is decoded by codec
+    decoder = _compile_decoder(tuple(return_type))
+    if decoder is not None and len(return_data) >= decoder[0]:
+        try:
+            decoded = [decode(return_data, position) for position, decode in decoder[1]]
+        except ValueError:
+            pass
+        else:
+            return decoded[0] if len(decoded) == 1 else decoded
+
     try:
         decoded_data = codec.decode(return_type, return_data)
         normalized_data = map_abi_data(BASE_RETURN_NORMALIZERS, return_type, decoded_data)
@@ -38,3 +198,177 @@ def decode_return_data(return_data: bytes | bytearray, return_type: list[str], c
     except DecodingError as e:
         logger.error(f"Failed to decode {return_data} as {return_type}: {e}")
     return None
+
+
+def parse_signature(signature: str) -> tuple[str, list[str], list[str]]:
+    """Splits signature like "balanceOf(address)(uint256)" into name, input types and output types"""
+    name, _, types = signature.partition("(")
+    depth = 0
+    for i, char in enumerate(types):
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        if depth < 0:
+            inputs, outputs = types[:i], types[i + 1 :]
+            break
+    else:
+        raise ValueError(f"Invalid function signature: {signature}")
+
+    if not name or (outputs and not (outputs.startswith("(") and outputs.endswith(")"))):
+        raise ValueError(f"Invalid function signature: {signature}")
+    input_types = [component.to_type_str() for component in parse(f"({inputs})").components]
+    output_types = [component.to_type_str() for component in parse(outputs or "()").components]
+    return name, input_types, output_types
+
+
+def _uint_encoder(bits: int) -> Callable[[int], bytes]:
+    bound = 2**bits
+
+    def encode(value: int) -> bytes:
+        if not 0 <= value < bound:
+            raise ValueError(f"Value {value} out of bounds for uint{bits}")
+        return value.to_bytes(32, "big")
+
+    return encode
+
+
+def _int_encoder(bits: int) -> Callable[[int], bytes]:
+    bound = 2 ** (bits - 1)
+
+    def encode(value: int) -> bytes:
+        if not -bound <= value < bound:
+            raise ValueError(f"Value {value} out of bounds for int{bits}")
+        return value.to_bytes(32, "big", signed=True)
+
+    return encode
+
+
+def _bytes_encoder(size: int) -> Callable[[bytes | str], bytes]:
+    def encode(value: bytes | str) -> bytes:
+        if isinstance(value, str):
+            value = bytes.fromhex(value[2:] if value.startswith("0x") else value)
+        if len(value) > size:
+            raise ValueError(f"Value {value!r} is too long for bytes{size}")
+        return value + bytes(32 - len(value))
+
+    return encode
+
+
+def _encode_address(value: str | bytes) -> bytes:
+    if isinstance(value, str):
+        value = bytes.fromhex(value[2:])
+    if len(value) != 20:
+        raise ValueError(f"Invalid address: {value!r}")
+    return bytes(12) + value
+
+
+def _encode_bool(value: bool) -> bytes:
+    if not isinstance(value, bool):
+        raise ValueError(f"Value {value!r} is not bool")
+    return (1 if value else 0).to_bytes(32, "big")
+
+
+def _static_encoder(abi_type: str) -> Callable[[Any], bytes] | None:
+    # encoders of single word types, other types are encoded by codec
+    parsed = parse(abi_type)
+    if not isinstance(parsed, BasicType) or parsed.arrlist:
+        return None
+    if parsed.base == "uint":
+        return _uint_encoder(parsed.sub)
+    if parsed.base == "int":
+        return _int_encoder(parsed.sub)
+    if parsed.base == "address":
+        return _encode_address
+    if parsed.base == "bool":
+        return _encode_bool
+    if parsed.base == "bytes" and parsed.sub is not None:
+        return _bytes_encoder(parsed.sub)
+    return None
+
+
+class CallTemplate:
+    """
+    Encodes calls of a single function in bulk from cached selector, without building a ContractFunction per call.
+    Arguments of static single word types (uint, int, address, bool, bytesN) are encoded directly, other types with
+    the same codec web3 uses. Addresses aren't checked against checksum and ENS names aren't resolved on direct path.
+
+    Function can be given as abi, signature with output types like "balanceOf(address)(uint256)" or a function of
+    web3 contract (e.g. contract.functions.balanceOf).
+    """
+
+    def __init__(self, function: dict | str | type[ContractFunction] | ContractFunction):
+        if isinstance(function, str):
+            self.name, self.input_types, self.return_types = parse_signature(function)
+        else:
+            abi = function if isinstance(function, dict) else self._function_abi(function)
+            self.name = abi["name"]
+            self.input_types = get_abi_input_types(abi)
+            self.return_types = get_abi_output_types(abi)
+
+        self.selector = function_signature_to_4byte_selector(f"{self.name}({','.join(self.input_types)})")
+        self._prefix = "0x" + self.selector.hex()
+
+        encoders = [_static_encoder(abi_type) for abi_type in self.input_types]
+        self._encoders = None if None in encoders else encoders
+
+    @staticmethod
+    def _function_abi(function: type[ContractFunction] | ContractFunction) -> dict:
+        if function.abi is not None:
+            return function.abi
+        # contract function not called yet, find abi by name
+        abis = filter_by_name(function.fn_name, function.contract_abi)
+        if len(abis) != 1:
+            raise ValueError(f"Function {function.fn_name} is overloaded, use its abi or signature instead")
+        return abis[0]
+
+    def encode(self, *args: Any) -> HexStr:
+        return self.encode_many([args])[0]
+
+    def encode_many(self, args: Iterable[Sequence[Any]]) -> list[HexStr]:
+        """Encodes calldata of a call for every sequence of arguments"""
+        prefix, encoders = self._prefix, self._encoders
+
+        if encoders is None:
+            types = self.input_types
+            return [
+                prefix + _codec.encode(types, map_abi_data(_INPUT_NORMALIZERS, types, list(call_args))).hex()
+                for call_args in args
+            ]
+
+        if len(encoders) == 1:
+            (encoder,) = encoders
+            return [prefix + encoder(value).hex() for (value,) in args]
+
+        encoded = []
+        for call_args in args:
+            if len(call_args) != len(encoders):
+                raise ValueError(f"Expected {len(encoders)} arguments for {self.name}, got {len(call_args)}")
+            encoded.append(prefix + b"".join(encoder(value) for encoder, value in zip(encoders, call_args)).hex())
+        return encoded
+
+    def __repr__(self) -> str:
+        return f"CallTemplate({self.name}({','.join(self.input_types)})({','.join(self.return_types)}))"
+
+
+@lru_cache(maxsize=None)
+def _signature_template(signature: str) -> CallTemplate:
+    return CallTemplate(signature)
+
+
+class SignatureCall:
+    """
+    Lightweight call built from signature with output types, target and arguments, e.g.
+    SignatureCall("balanceOf(address)(uint256)", token, holder). Signatures are parsed once and shared by all calls,
+    so lists of calls take a fraction of memory and setup time of contract functions.
+    """
+
+    __slots__ = ("template", "address", "args")
+
+    def __init__(self, signature: str, address: ChecksumAddress, *args: Any):
+        self.template = _signature_template(signature)
+        self.address = address
+        self.args = args
+
+    def _encode_transaction_data(self) -> HexStr:
+        return self.template.encode(*self.args)
+
+    def __repr__(self) -> str:
+        return f"SignatureCall({self.template.name}, {self.address}, {self.args})"
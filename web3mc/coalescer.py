@@ -0,0 +1,94 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+from web3.types import BlockIdentifier
+
+from .call import Call
+
+Execute = Callable[[Call, BlockIdentifier], Awaitable[tuple[int | None, list[tuple[bool, bytes]]]]]
+
+
+class _Queue:
+    __slots__ = ("block_identifier", "callers", "size", "timer")
+
+    def __init__(self, block_identifier: BlockIdentifier):
+        self.block_identifier = block_identifier
+        self.callers: list[tuple[Call, asyncio.Future]] = []
+        self.size = 0
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class Coalescer:
+    """
+    Merges calls of concurrent aggregates at the same block into shared aggregates (like DataLoader). Calls submitted
+    within window seconds of the first one, or until max_calls of them are collected, are sent together and every
+    caller gets block number and (success, return data) of its own calls.
+    """
+
+    def __init__(self, execute: Execute, window: float, max_calls: Callable[[], int]):
+        self.execute = execute
+        self.window = window
+        self.max_calls = max_calls
+        # number of submitted lists of calls and of shared aggregates they were sent in
+        self.submitted = 0
+        self.sent = 0
+
+        # calls waiting to be sent, per event loop and block
+        self._queues: dict[tuple[asyncio.AbstractEventLoop, Hashable], _Queue] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(
+        self, call: Call, block_identifier: BlockIdentifier, key: Hashable
+    ) -> tuple[int | None, list[tuple[bool, bytes]]]:
+        """
+        :param call: calls to send
+        :param block_identifier: block of calls
+        :param key: hashable key of the block, calls with the same key are merged
+        :return: block number of calls and (success, return data) of calls
+        """
+        loop = asyncio.get_running_loop()
+        queue_key = (loop, key)
+        future = loop.create_future()
+
+        queue = self._queues.get(queue_key)
+        if queue is None:
+            queue = self._queues[queue_key] = _Queue(block_identifier)
+            queue.timer = loop.call_later(self.window, self._flush, queue_key)
+        queue.callers.append((call, future))
+        queue.size += len(call)
+        self.submitted += 1
+
+        if queue.size >= self.max_calls():
+            self._flush(queue_key)
+        return await future
+
+    def _flush(self, queue_key: tuple[asyncio.AbstractEventLoop, Hashable]) -> None:
+        queue = self._queues.pop(queue_key)
+        queue.timer.cancel()
+
+        self.sent += 1
+        task = asyncio.ensure_future(self._send(queue))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, queue: _Queue) -> None:
+        try:
+            block_number, results = await self.execute(
+                Call.join([call for call, _ in queue.callers]), queue.block_identifier
+            )
+        except asyncio.CancelledError:
+            for _, future in queue.callers:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in queue.callers:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        start = 0
+        for call, future in queue.callers:
+            # callers cancelled while waiting are skipped
+            if not future.done():
+                future.set_result((block_number, results[start : start + len(call)]))
+            start += len(call)
@@ -0,0 +1,138 @@
+from functools import lru_cache
+from typing import Any
+
+from eth_abi.grammar import BasicType, parse
+
+from .planner import static_return_size
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, pip install web3mc[numpy]
+    np = None
+
+
+class Columns:
+    """
+    Results of calls with the same return type, one array per returned value and validity mask of calls.
+
+    - uint8..uint64, int8..int64 and bool are numpy arrays of the smallest fitting dtype
+    - wider integers are object arrays of python ints
+    - address and bytesN are fixed width byte arrays (S20, S<N>), note numpy strips trailing zero bytes of items
+    - fixed size arrays add a dimension to the array of their item type
+
+    Values of failed calls are zeros, valid is False for them.
+    """
+
+    def __init__(self, columns: list, valid):
+        self.columns = columns
+        self.valid = valid
+
+    def __getitem__(self, index: int):
+        return self.columns[index]
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __repr__(self) -> str:
+        return f"Columns(calls={len(self.valid)}, columns={len(self.columns)})"
+
+    @classmethod
+    def stack(cls, items: list["Columns"]) -> "Columns":
+        """
+        Stacks Columns of the same calls (e.g. results of aggregate_range at every block) into Columns with a leading
+        dimension, item [i, j] of every array is value of call j in items[i]
+        """
+        columns = [np.stack([item.columns[k] for item in items]) for k in range(len(items[0].columns))]
+        return cls(columns, np.stack([item.valid for item in items]))
+
+
+def _word_field(abi_type: BasicType, offset: int) -> tuple[str, int, Any]:
+    # (numpy format of the value inside abi word, its offset and output dtype), output dtype is None for python ints
+    bits = abi_type.sub
+    if abi_type.base in ("uint", "int") and bits <= 64:
+        size = next(size for size in (1, 2, 4, 8) if bits <= size * 8)
+        kind = "u" if abi_type.base == "uint" else "i"
+        return f">{kind}{size}", offset + 32 - size, np.dtype(f"{kind}{size}")
+    if abi_type.base in ("uint", "int"):
+        return "V32", offset, None
+    if abi_type.base == "bool":
+        return "u1", offset + 31, np.dtype(bool)
+    if abi_type.base == "address":
+        return "S20", offset + 12, np.dtype("S20")
+    if abi_type.base == "bytes" and bits is not None:
+        return f"S{bits}", offset, np.dtype(f"S{bits}")
+    raise ValueError(f"Type {abi_type.to_type_str()} is not supported in columns")
+
+
+@lru_cache(maxsize=None)
+def _layout(return_type: tuple[str, ...]) -> list[tuple[BasicType, tuple[int, ...], list[int]]]:
+    # (item type, shape, offsets of items) of every returned value
+    layout = []
+    offset = 0
+    for type_str in return_type:
+        abi_type = parse(type_str)
+        shape = tuple(dimension[0] for dimension in reversed(abi_type.arrlist or ()))
+        if not isinstance(abi_type, BasicType) or abi_type.is_dynamic:
+            raise ValueError(f"Type {type_str} is not supported in columns")
+
+        items = 1
+        for dimension in shape:
+            items *= dimension
+        layout.append((BasicType(abi_type.base, abi_type.sub), shape, [offset + 32 * i for i in range(items)]))
+        offset += 32 * items
+    return layout
+
+
+def check_columns(return_type: list[str]) -> None:
+    """Raises if results of return type can't be returned as columns"""
+    if np is None:
+        raise ImportError("numpy is required for columns, install web3mc[numpy]")
+    if static_return_size(tuple(return_type)) == 0:
+        raise ValueError(f"Columns need static return types, got {return_type}")
+    for abi_type, _, offsets in _layout(tuple(return_type)):
+        _word_field(abi_type, offsets[0])
+
+
+def build_columns(results: list[tuple[bool, bytes]], return_type: list[str]) -> Columns:
+    """Builds columns from (success, return data) of calls with the same return type without decoding every value"""
+    check_columns(return_type)
+    width = static_return_size(tuple(return_type))
+
+    empty = bytes(width)
+    valid = np.fromiter((success and len(data) >= width for success, data in results), dtype=bool, count=len(results))
+    buffer = b"".join(data[:width] if is_valid else empty for (_, data), is_valid in zip(results, valid))
+
+    columns = []
+    for abi_type, shape, offsets in _layout(tuple(return_type)):
+        fields = [_word_field(abi_type, offset) for offset in offsets]
+        dtype = np.dtype(
+            {
+                "names": [f"f{i}" for i in range(len(fields))],
+                "formats": [field_format for field_format, _, _ in fields],
+                "offsets": [field_offset for _, field_offset, _ in fields],
+                "itemsize": width,
+            }
+        )
+        records = np.frombuffer(buffer, dtype=dtype, count=len(results))
+        output_dtype = fields[0][2]
+
+        if output_dtype is None:
+            signed = abi_type.base == "int"
+            values = [
+                np.fromiter(
+                    (int.from_bytes(bytes(value), "big", signed=signed) for value in records[f"f{i}"]),
+                    dtype=object,
+                    count=len(results),
+                )
+                for i in range(len(fields))
+            ]
+        else:
+            values = [records[f"f{i}"].astype(output_dtype) for i in range(len(fields))]
+
+        column = np.stack(values, axis=1) if shape else values[0]
+        columns.append(column.reshape((len(results), *shape)))
+
+    return Columns(columns, valid)
@@ -0,0 +1,140 @@
+from eth_abi.codec import ABICodec
+from eth_typing import ChecksumAddress, HexStr
+from eth_utils import function_signature_to_4byte_selector
+
+AGGREGATE = function_signature_to_4byte_selector("aggregate((address,bytes)[])")
+TRY_AGGREGATE = function_signature_to_4byte_selector("tryAggregate(bool,(address,bytes)[])")
+AGGREGATE3 = function_signature_to_4byte_selector("aggregate3((address,bool,bytes)[])")
+
+_ZERO_PADDING = bytes(32)
+_TRUE = (1).to_bytes(32, "big")
+_FALSE = bytes(32)
+
+
+def _word(value: int) -> bytes:
+    return value.to_bytes(32, "big")
+
+
+def _encode_bytes(data: bytes) -> bytes:
+    return _word(len(data)) + data + _ZERO_PADDING[: -len(data) % 32]
+
+
+def _encode_array(elements: list[bytes]) -> bytes:
+    # dynamic array of dynamic elements: length, offsets of elements (relative to offsets start), elements
+    offsets = []
+    offset = 32 * len(elements)
+    for element in elements:
+        offsets.append(_word(offset))
+        offset += len(element)
+    return _word(len(elements)) + b"".join(offsets) + b"".join(elements)
+
+
+def _encode_calls(call_data: list[tuple[ChecksumAddress, HexStr]], allow_failure: list[bool] | None = None) -> bytes:
+    elements = []
+    if allow_failure is None:
+        for target, data in call_data:
+            elements.append(
+                _ZERO_PADDING[:12] + bytes.fromhex(target[2:]) + _word(64) + _encode_bytes(bytes.fromhex(data[2:]))
+            )
+    else:
+        for (target, data), allow in zip(call_data, allow_failure):
+            elements.append(
+                _ZERO_PADDING[:12]
+                + bytes.fromhex(target[2:])
+                + (_TRUE if allow else _FALSE)
+                + _word(96)
+                + _encode_bytes(bytes.fromhex(data[2:]))
+            )
+    return _encode_array(elements)
+
+
+def encode_aggregate(call_data: list[tuple[ChecksumAddress, HexStr]]) -> bytes:
+    return AGGREGATE + _word(32) + _encode_calls(call_data)
+
+
+def encode_try_aggregate(require_success: bool, call_data: list[tuple[ChecksumAddress, HexStr]]) -> bytes:
+    return TRY_AGGREGATE + (_TRUE if require_success else _FALSE) + _word(64) + _encode_calls(call_data)
+
+
+def encode_aggregate3(call_data: list[tuple[ChecksumAddress, HexStr]], allow_failure: list[bool]) -> bytes:
+    return AGGREGATE3 + _word(32) + _encode_calls(call_data, allow_failure)
+
+
+def encode_compact(call_data: list[tuple[ChecksumAddress, HexStr]], widths: list[int]) -> bytes:
+    """Encodes calls for compact multicall, widths are sizes of static return data (0 for dynamic return types)"""
+    parts = [len(call_data).to_bytes(4, "big")]
+    for (target, data), width in zip(call_data, widths):
+        data = bytes.fromhex(data[2:])
+        parts.append(bytes.fromhex(target[2:]) + width.to_bytes(2, "big") + len(data).to_bytes(3, "big") + data)
+    return b"".join(parts)
+
+
+def _read_word(data: bytes, position: int) -> int:
+    if position + 32 > len(data):
+        raise ValueError("Return data is too short")
+    return int.from_bytes(data[position : position + 32], "big")
+
+
+def _read_bytes(data: bytes, position: int) -> bytes:
+    length = _read_word(data, position)
+    if position + 32 + length > len(data):
+        raise ValueError("Return data is too short")
+    return data[position + 32 : position + 32 + length]
+
+
+def _decode_aggregate(data: bytes) -> list[tuple[bool, bytes]]:
+    # (uint256 blockNumber, bytes[] returnData)
+    array = _read_word(data, 32)
+    elements = array + 32
+    return [
+        (True, _read_bytes(data, elements + _read_word(data, elements + 32 * i)))
+        for i in range(_read_word(data, array))
+    ]
+
+
+def _decode_results(data: bytes) -> list[tuple[bool, bytes]]:
+    # (bool success, bytes returnData)[]
+    array = _read_word(data, 0)
+    elements = array + 32
+    results = []
+    for i in range(_read_word(data, array)):
+        element = elements + _read_word(data, elements + 32 * i)
+        results.append((_read_word(data, element) == 1, _read_bytes(data, element + _read_word(data, element + 32))))
+    return results
+
+
+def decode_aggregate(data: bytes, codec: ABICodec) -> list[tuple[bool, bytes]]:
+    """Decodes result of aggregate as (success, return data) pairs, falls back to codec if data is malformed"""
+    try:
+        return _decode_aggregate(data)
+    except ValueError:
+        _, results = codec.decode(["uint256", "bytes[]"], data)
+        return [(True, result) for result in results]
+
+
+def decode_results(data: bytes, codec: ABICodec) -> list[tuple[bool, bytes]]:
+    """Decodes result of tryAggregate or aggregate3, falls back to codec if data is malformed"""
+    try:
+        return _decode_results(data)
+    except ValueError:
+        return codec.decode(["(bool,bytes)[]"], data)[0]
+
+
+def decode_compact(data: bytes, widths: list[int]) -> list[tuple[bool, bytes]]:
+    """Decodes result of compact multicall as (success, return data) pairs"""
+    bitmap_size = (len(widths) + 255) // 256 * 32
+    bitmap = int.from_bytes(data[32 : 32 + bitmap_size], "big")
+    last_bit = bitmap_size * 8 - 1
+
+    results = []
+    position = 32 + bitmap_size
+    for i, width in enumerate(widths):
+        if width == 0:
+            width = int.from_bytes(data[position : position + 4], "big")
+            position += 4
+        results.append((bool(bitmap >> (last_bit - i) & 1), data[position : position + width]))
+        position += width
+
+    if position != len(data):
+        raise ValueError("Unexpected size of compact multicall return data")
+    return results
@@ -1,2 +1,13 @@
 class MaxRetriesExceeded(Exception):
-    pass
+    def __init__(self, message: str, failed_batches: list[int] | None = None):
+        super().__init__(message)
+        # indexes of batches that still failed after the last attempt
+        self.failed_batches = failed_batches or []
+
+
+class CallsReverted(Exception):
+    def __init__(self, message: str, indexes: list[int], results: list):
+        super().__init__(message)
+        # indexes of reverting calls and results of all calls (None for reverted ones)
+        self.indexes = indexes
+        self.results = results
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class HedgingPolicy:
+    """
+    Sends a duplicate of a request that hasn't returned within a deadline, the first successful response wins and the
+    other request is cancelled.
+
+    The deadline is the percentile of latencies of the last window requests (not lower than min_delay), hedging starts
+    after min_samples of them. At most budget share of requests are hedged.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        budget: float = 0.05,
+        min_delay: float = 0.01,
+        window: int = 1000,
+        min_samples: int = 20,
+    ):
+        if not 0 < percentile < 1:
+            raise ValueError("Hedging percentile should be between 0 and 1.")
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        # number of requests, of hedges sent and of hedges that returned first
+        self.requests = 0
+        self.hedged = 0
+        self.won = 0
+
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._deadline: float | None = None
+        self._stale = 0
+
+    @property
+    def deadline(self) -> float | None:
+        """Seconds after which a request is hedged, None until enough latencies are observed"""
+        if len(self._latencies) < self.min_samples:
+            return None
+        # sorting the window is only repeated after a share of it was replaced
+        if self._deadline is None or self._stale > len(self._latencies) // 16:
+            latencies = sorted(self._latencies)
+            self._deadline = max(latencies[int(self.percentile * (len(latencies) - 1))], self.min_delay)
+            self._stale = 0
+        return self._deadline
+
+    def observe(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self._stale += 1
+
+    async def run(self, send: Callable[[], Awaitable[T]]) -> T:
+        """Awaits send() and hedges it with another send() after the deadline if budget allows"""
+        self.requests += 1
+        deadline = self.deadline
+        if deadline is None:
+            start = time.monotonic()
+            result = await send()
+            self.observe(time.monotonic() - start)
+            return result
+
+        primary = asyncio.ensure_future(send())
+        start = time.monotonic()
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=deadline)
+            if not done and self.hedged < self.budget * self.requests:
+                self.hedged += 1
+                hedge = asyncio.ensure_future(send())
+                pending.add(hedge)
+
+            while True:
+                # primary wins ties, its error is raised if every request fails
+                succeeded = [
+                    task for task in sorted(done, key=lambda task: task is not primary) if not task.exception()
+                ]
+                if succeeded:
+                    self.won += succeeded[0] is not primary
+                    # latency of primary request, a lower bound of it if hedge won
+                    self.observe(time.monotonic() - start)
+                    return succeeded[0].result()
+                if not pending:
+                    return primary.result()
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # loser (or both requests if the caller was cancelled)
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+from collections import deque
+
+
+class _Waiter:
+    __slots__ = ("loop", "future", "granted")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+
+def _wake_up(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the number of requests in flight. Unlike a semaphore created per aggregate, a single limiter is shared by
+    every caller of a Multicall instance (including callers running on different event loops), waiters are served
+    in FIFO order and the limit can be changed at runtime.
+    """
+
+    def __init__(self, limit: int):
+        if limit < 1:
+            raise ValueError("Concurrency limit should be positive.")
+        self._limit = limit
+        self._in_flight = 0
+        self._waiters: deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @limit.setter
+    def limit(self, value: int) -> None:
+        with self._lock:
+            self._limit = max(1, value)
+            self._wake()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        with self._lock:
+            if self._in_flight < self._limit and not self._waiters:
+                self._in_flight += 1
+                return
+            waiter = _Waiter(asyncio.get_running_loop())
+            self._waiters.append(waiter)
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    # slot was handed over while we were being cancelled, pass it on
+                    self._in_flight -= 1
+                    self._wake()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._wake()
+
+    def _wake(self) -> None:
+        # must be called with the lock held
+        while self._waiters and self._in_flight < self._limit:
+            waiter = self._waiters.popleft()
+            try:
+                waiter.loop.call_soon_threadsafe(_wake_up, waiter.future)
+            except RuntimeError:
+                # waiter's event loop is already closed
+                continue
+            waiter.granted = True
+            self._in_flight += 1
+
+    async def __aenter__(self) -> None:
+        await self.acquire()
+
+    async def __aexit__(self, *args) -> None:
+        self.release()
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+from typing import Awaitable, TypeVar
+
+T = TypeVar("T")
+
+
+async def _wait(awaitable: Awaitable[T]) -> T:
+    return await awaitable
+
+
+class LoopThread:
+    """
+    Event loop running in a daemon thread, started on first use. Runs coroutines for sync code, so connections and
+    other loop bound state are kept between calls and sync code can be called while another event loop is running.
+    """
+
+    def __init__(self, name: str = "web3mc"):
+        self.name = name
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._run, args=(self._loop,), name=self.name, daemon=True)
+                self._thread.start()
+            return self._loop
+
+    @staticmethod
+    def _run(loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def run(self, awaitable: Awaitable[T]) -> T:
+        """Runs awaitable (e.g. coroutine or async generator step) in the loop and waits for its result"""
+        coroutine = awaitable if asyncio.iscoroutine(awaitable) else _wait(awaitable)
+        loop = self.loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            coroutine.close()
+            raise RuntimeError("Can't wait for a coroutine in its own event loop, use async methods instead")
+
+        future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+        try:
+            return future.result()
+        except BaseException:
+            # e.g. KeyboardInterrupt, don't leave coroutine running
+            future.cancel()
+            raise
+
+    def close(self) -> None:
+        """Stops the loop, a new one is started on next use"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            if thread is not threading.current_thread():
+                thread.join()
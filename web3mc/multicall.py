@@ -1,199 +1,1059 @@
 import asyncio
-import functools
 import itertools
 import logging
+import random
 import time
-from typing import Any
+import weakref
+from contextlib import aclosing
+from functools import cached_property
+from typing import Any, AsyncIterator, Coroutine, Iterable, Iterator, TypeVar
 
+from aiohttp import ClientError
 from eth_typing import ChecksumAddress, HexStr
-from eth_utils import to_checksum_address
+from eth_utils import keccak, to_checksum_address
+from hexbytes import HexBytes
 from web3 import AsyncHTTPProvider, AsyncWeb3, HTTPProvider, Web3
 from web3.contract.contract import ContractFunction
 from web3.exceptions import ContractLogicError
 from web3.types import BlockIdentifier
 
 from .abi import multicall2_abi, multicall3_abi
-from .call import Call, decode_return_data
+from .cache import ResultCache
+from .call import Call, SignatureCall, decode_return_data
+from .coalescer import Coalescer
+from .columns import Columns, build_columns, check_columns
 from .constants import (
+    COMPACT_MULTICALL_ADDRESS,
     MAX_GAS_LIMIT,
     MULTICALL2_ADDRESSES,
-    MULTICALL2_BYTECODE,
+    MULTICALL2_CODE_HASH,
     MULTICALL3_ADDRESSES,
-    MULTICALL3_BYTECODE,
+    MULTICALL3_CODE_HASH,
     NO_STATE_OVERRIDE,
 )
-from .exceptions import MaxRetriesExceeded
+from .encoding import (
+    decode_aggregate,
+    decode_compact,
+    decode_results,
+    encode_aggregate,
+    encode_aggregate3,
+    encode_compact,
+    encode_try_aggregate,
+)
+from .exceptions import CallsReverted, MaxRetriesExceeded
+from .hedging import HedgingPolicy
+from .limiter import ConcurrencyLimiter
+from .loop import LoopThread
+from .planner import BatchPlanner, is_out_of_gas, is_response_too_large, static_return_size
+from .pool import ProviderPool
+from .ratelimit import RateLimit
+from .transport import RPCTransport, format_block_identifier
+from .tuner import AutoTuner
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# placeholder for results of calls found to revert while isolating failures
+_REVERTED = object()
+
+# attributes set once chain id is known
+_CHAIN_ATTRIBUTES = ("chain_id", "version", "async_contract")
+# chain id per provider url and block from which multicall is deployed with the expected code (None if it isn't) per
+# (provider url, address), shared by instances so only the first one makes requests
+_chain_ids: dict[str, int] = {}
+_deployed: dict[tuple[str, str], int | None] = {}
+
+# block tags resolved to a block of the node when calls are sent in several batches, all batches are sent at its hash
+PINNED_TAGS = ("latest", "safe", "finalized")
+# number of recent block hashes whose numbers are kept, to send calls at them without state override
+MAX_BLOCK_NUMBERS = 256
+
+# errors after which batches are sent again
+RETRY_ERRORS = (ContractLogicError, ValueError, ClientError, asyncio.TimeoutError)
+
+
+def _deduplicate(call: Call, allow_failure: list[bool]) -> tuple[Call, list[bool], list[int]]:
+    # unique (target, calldata) calls, their allow_failure flags (a call may fail only if all its copies may) and
+    # position of every call in unique calls
+    unique = Call([], None)
+    unique.encoded_data, unique.return_types, unique_allow_failure = [], [], []
+    positions, seen = [], {}
+    for (address, data), return_type, allowed in zip(call.encoded_data, call.return_types, allow_failure):
+        key = (address.lower(), data)
+        position = seen.get(key)
+        if position is None:
+            position = seen[key] = len(unique.encoded_data)
+            unique.encoded_data.append((address, data))
+            unique.return_types.append(return_type)
+            unique_allow_failure.append(allowed)
+        elif not allowed:
+            unique_allow_failure[position] = False
+        positions.append(position)
+    return unique, unique_allow_failure, positions
+
+
+async def _as_completed(coroutines: Iterator[Coroutine[Any, Any, T]], max_pending: int) -> AsyncIterator[T]:
+    # runs at most max_pending coroutines at a time (taken lazily), yields their results as they complete
+    pending: set[asyncio.Task] = set()
+    try:
+        while True:
+            for coroutine in itertools.islice(coroutines, max_pending - len(pending)):
+                pending.add(asyncio.ensure_future(coroutine))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # consumer stopped early or a coroutine failed
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
 
 class Multicall:
     def __init__(
         self,
-        provider_url: str | None = None,
+        provider_url: str | list[str] | None = None,
         batch: int = 100,
         max_retries: int = 3,
         gas_limit: int = 15_000_000,
+        max_calldata_bytes: int = 250_000,
+        max_return_bytes: int = 1_000_000,
+        retry_backoff: float = 0.1,
+        auto_tune: bool = False,
+        rpc_batch_bytes: int | None = None,
+        fast_path: bool = True,
+        compact: bool = False,
+        chain_id: int | None = None,
+        coalesce_window: float | None = None,
+        cache: ResultCache | None = None,
+        hedging: HedgingPolicy | None = None,
+        rate_limit: RateLimit | dict[str, RateLimit] | None = None,
         _semaphore: int = 1000,
     ):
-        self.web3 = Web3(HTTPProvider(provider_url))
-        self.async_web3 = AsyncWeb3(AsyncHTTPProvider(provider_url))
-
+        # several urls of the same chain are used as a pool of endpoints, the first one is used for setup
+        provider_urls = [provider_url] if provider_url is None or isinstance(provider_url, str) else provider_url
+        self.provider_url = provider_urls[0]
         self.batch = batch
         self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
         self._semaphore = _semaphore
         self.gas_limit = gas_limit
+        self.fast_path = fast_path
+        self.compact = compact
 
-        self.chain_id: int = self.web3.eth.chain_id
-        if self.chain_id in MULTICALL3_ADDRESSES:
-            self.async_contract = self.async_web3.eth.contract(
-                address=to_checksum_address(MULTICALL3_ADDRESSES[self.chain_id]), abi=multicall3_abi
-            )
-            self.version = 3
-        elif self.chain_id in MULTICALL2_ADDRESSES:
-            self.async_contract = self.async_web3.eth.contract(
-                address=to_checksum_address(MULTICALL2_ADDRESSES[self.chain_id]), abi=multicall2_abi
+        if self.compact and not self.fast_path:
+            raise ValueError("Compact results need fast path!")
+        if len(provider_urls) > 1 and not self.fast_path:
+            raise ValueError("Provider pool needs fast path!")
+        if rate_limit is not None and not self.fast_path:
+            raise ValueError("Rate limit needs fast path!")
+        if hedging is not None and not self.fast_path:
+            raise ValueError("Hedging needs fast path!")
+        if rpc_batch_bytes is not None and not self.fast_path:
+            raise ValueError("JSON-RPC batch requests need fast path!")
+
+        # shared by all aggregates running on this instance, caps eth_call requests in flight to the provider
+        self._limiter = ConcurrencyLimiter(_semaphore)
+        # splits calls into batches, batch is the max number of calls in a single batch
+        self.planner = BatchPlanner(max_calldata_bytes, max_return_bytes)
+        # requests per second and compute units per second per provider url, a single limit is shared by all urls
+        rate_limits = rate_limit if isinstance(rate_limit, dict) else {url: rate_limit for url in provider_urls}
+        # with several provider urls requests are balanced between them and failed ones are sent to another endpoint,
+        # each endpoint has its own concurrency limit and tuner
+        self.pool = (
+            ProviderPool.from_urls(
+                provider_urls,
+                rpc_batch_bytes,
+                rate_limits,
+                concurrency=_semaphore,
+                tune_batch=batch if auto_tune else None,
             )
-            self.version = 2
-        else:
-            raise ValueError("Connected to unknown chain id!")
+            if len(provider_urls) > 1
+            else None
+        )
+        # adjusts batch size and concurrency to the provider, starting from batch and up to _semaphore
+        self.tuner = AutoTuner(self._limiter, batch) if auto_tune and self.pool is None else None
+        # sends eth_call requests on fast path, packs concurrent ones into JSON-RPC batch requests of up to
+        # rpc_batch_bytes
+        self._transport = self.pool or RPCTransport(
+            AsyncHTTPProvider(self.provider_url), rpc_batch_bytes, rate_limits.get(self.provider_url)
+        )
+        # merges small aggregates at the same block issued within coalesce_window seconds into shared ones
+        self._coalescer = (
+            Coalescer(self._execute_shared, coalesce_window, lambda: self._max_calls)
+            if coalesce_window is not None
+            else None
+        )
+        # results of successful calls per block, shared with other instances it's passed to
+        self.cache = cache
+        # sends a duplicate of eth_call requests slower than a latency percentile (to another endpoint of the pool)
+        self.hedging = hedging
+        # number of calls passed to aggregates and of unique (target, calldata) ones among them that were sent
+        self.total_calls = 0
+        self.unique_calls = 0
+        # event loop of sync methods, kept between calls so pooled connections are reused
+        self._loop_thread = LoopThread(name=f"web3mc-{id(self):x}")
+        weakref.finalize(self, self._loop_thread.close)
 
-        if self.chain_id in MAX_GAS_LIMIT:
-            logger.info("Using network max gas limit")
-            self.gas_limit = MAX_GAS_LIMIT[self.chain_id]
+        # chain_id, version and async_contract are resolved on first use (no requests are made here), state override
+        # after checking multicall code
+        self._ready = False
+        # numbers of blocks pinned to their hash
+        self._block_numbers: dict[bytes, int] = {}
+        if chain_id is not None:
+            self._set_chain(chain_id)
+
+    @cached_property
+    def web3(self) -> Web3:
+        return Web3(HTTPProvider(self.provider_url))
+
+    @cached_property
+    def async_web3(self) -> AsyncWeb3:
+        return AsyncWeb3(self._transport.provider)
+
+    def __getattr__(self, name: str) -> Any:
+        # chain dependent attributes read before any aggregate are resolved with blocking requests
+        if name in _CHAIN_ATTRIBUTES and not self.__dict__.get("_ready", True):
+            self._setup()
+            return getattr(self, name)
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def close(self) -> None:
+        """Stops event loop thread of sync methods, it's started again on next sync call"""
+        self._loop_thread.close()
 
     def aggregate(
         self,
-        calls: list[ContractFunction],
+        calls: list[ContractFunction | SignatureCall] | Call,
         block_identifier: BlockIdentifier = "latest",
         use_try: bool = False,
         addresses: list[ChecksumAddress] | None = None,
-    ) -> list[Any]:
+        isolate_failures: bool = False,
+        allow_failure: list[bool] | None = None,
+        columns: bool = False,
+        return_block: bool = False,
+    ) -> list[Any] | Columns | tuple[int | None, list[Any] | Columns]:
         """
-        Calls aggregate or tryAggregate on web3multicall but lets user (optionally) specify a list of target addresses
-        corresponding to each ContractFunction. This is useful to optimize in cases where we might only want to load
-        a few abis with function signatures but call the same functions on different contracts using the same ABI.
-        (ContractFunction is heavy to instantiate)
+        Calls aggregate3 (aggregate or tryAggregate on multicall2) on web3multicall but lets user (optionally) specify
+        a list of target addresses corresponding to each ContractFunction. This is useful to optimize in cases where we
+        might only want to load a few abis with function signatures but call the same functions on different contracts
+        using the same ABI. (ContractFunction is heavy to instantiate)
 
-        :param calls: list of contract function calls with parameters
+        :param calls: list of contract function (or SignatureCall) calls with parameters or Call encoded in bulk
+            (Call.from_template)
         :param block_identifier: web3 block identifier
-        :param use_try: use aggregate or tryAggregate
+        :param use_try: allow calls to fail (tryAggregate), failed calls return None
         :param addresses: optional list of target addresses corresponding to a list of calls
+        :param isolate_failures: without use_try, split reverting batches to find reverting calls instead of retrying
+            them, raises CallsReverted with their indexes
+        :param allow_failure: optional list of flags corresponding to a list of calls, overrides use_try per call
+            (failed calls with a flag return None, other calls must succeed), uses aggregate3 on multicall3
+        :param columns: return Columns of numpy arrays instead of a list, calls must have the same static return type
+        :param return_block: return (block number, results), block tags (latest, safe, finalized) are resolved to a
+            single block for all batches anyway
         :return: result of aggregation
         """
         start = time.time()
-        result = asyncio.run(
-            self._aggregate(calls, use_try=use_try, block_identifier=block_identifier, target_address_list=addresses)
+        result = self._loop_thread.run(
+            self._aggregate(
+                calls,
+                use_try=use_try,
+                block_identifier=block_identifier,
+                target_address_list=addresses,
+                isolate_failures=isolate_failures,
+                allow_failure=allow_failure,
+                columns=columns,
+                return_block=return_block,
+            )
         )
         logger.debug(f"Multicall took {time.time() - start} seconds")
         return result
 
     async def async_aggregate(
         self,
-        calls: list[ContractFunction],
+        calls: list[ContractFunction | SignatureCall] | Call,
         block_identifier: BlockIdentifier = "latest",
         use_try: bool = False,
         addresses: list[ChecksumAddress] | None = None,
-    ) -> list[Any]:
+        isolate_failures: bool = False,
+        allow_failure: list[bool] | None = None,
+        columns: bool = False,
+        return_block: bool = False,
+    ) -> list[Any] | Columns | tuple[int | None, list[Any] | Columns]:
         """
-        Calls aggregate or tryAggregate on web3multicall but lets user (optionally) specify a list of target addresses
-        corresponding to each ContractFunction. This is useful to optimize in cases where we might only want to load
-        a few abis with function signatures but call the same functions on different contracts using the same ABI.
-        (ContractFunction is heavy to instantiate)
+        Calls aggregate3 (aggregate or tryAggregate on multicall2) on web3multicall but lets user (optionally) specify
+        a list of target addresses corresponding to each ContractFunction. This is useful to optimize in cases where we
+        might only want to load a few abis with function signatures but call the same functions on different contracts
+        using the same ABI. (ContractFunction is heavy to instantiate)
 
-        :param calls: list of contract function calls with parameters
+        :param calls: list of contract function (or SignatureCall) calls with parameters or Call encoded in bulk
+            (Call.from_template)
         :param block_identifier: web3 block identifier
-        :param use_try: use aggregate or tryAggregate
+        :param use_try: allow calls to fail (tryAggregate), failed calls return None
         :param addresses: optional list of target addresses corresponding to a list of calls
+        :param isolate_failures: without use_try, split reverting batches to find reverting calls instead of retrying
+            them, raises CallsReverted with their indexes
+        :param allow_failure: optional list of flags corresponding to a list of calls, overrides use_try per call
+            (failed calls with a flag return None, other calls must succeed), uses aggregate3 on multicall3
+        :param columns: return Columns of numpy arrays instead of a list, calls must have the same static return type
+        :param return_block: return (block number, results), block tags (latest, safe, finalized) are resolved to a
+            single block for all batches anyway
         :return: result of aggregation
         """
         start = time.time()
         result = await self._aggregate(
-            calls, use_try=use_try, block_identifier=block_identifier, target_address_list=addresses
+            calls,
+            use_try=use_try,
+            block_identifier=block_identifier,
+            target_address_list=addresses,
+            isolate_failures=isolate_failures,
+            allow_failure=allow_failure,
+            columns=columns,
+            return_block=return_block,
         )
         logger.debug(f"Multicall took {time.time() - start} seconds")
         return result
 
+    def aggregate_iter(
+        self,
+        calls: Iterable[ContractFunction | SignatureCall],
+        block_identifier: BlockIdentifier = "latest",
+        use_try: bool = False,
+        isolate_failures: bool = False,
+        chunk_size: int | None = None,
+        max_pending: int = 16,
+    ) -> Iterator[tuple[int, list[Any]]]:
+        """
+        Same as async_aggregate_iter, for sync code
+
+        :return: iterator of (index of the first call in chunk, results of chunk)
+        """
+        return self._iterate(
+            self.async_aggregate_iter(
+                calls,
+                block_identifier=block_identifier,
+                use_try=use_try,
+                isolate_failures=isolate_failures,
+                chunk_size=chunk_size,
+                max_pending=max_pending,
+            )
+        )
+
+    async def async_aggregate_iter(
+        self,
+        calls: Iterable[ContractFunction | SignatureCall],
+        block_identifier: BlockIdentifier = "latest",
+        use_try: bool = False,
+        isolate_failures: bool = False,
+        chunk_size: int | None = None,
+        max_pending: int = 16,
+    ) -> AsyncIterator[tuple[int, list[Any]]]:
+        """
+        Aggregates calls in chunks and yields results of every chunk as soon as it's done, so calls can be consumed
+        from a lazy iterable and results processed while other chunks are in flight. At most max_pending chunks are
+        sent or held at a time, chunks may complete out of order.
+
+        :param calls: iterable of contract function (or SignatureCall) calls with parameters
+        :param block_identifier: web3 block identifier, use block number for results of all chunks at the same block
+        :param use_try: allow calls to fail (tryAggregate), failed calls return None
+        :param isolate_failures: without use_try, split reverting batches to find reverting calls instead of retrying
+            them, raises CallsReverted with their indexes in calls
+        :param chunk_size: number of calls in a chunk, batch size by default
+        :param max_pending: max number of chunks in flight
+        :return: async iterator of (index of the first call in chunk, results of chunk)
+        """
+        if not self._ready:
+            await self._async_setup()
+        calls = iter(calls)
+        chunk_size = chunk_size or self._max_calls
+
+        def chunks():
+            start = 0
+            while chunk := list(itertools.islice(calls, chunk_size)):
+                yield self._aggregate_chunk(start, chunk, use_try, block_identifier, isolate_failures)
+                start += len(chunk)
+
+        async with aclosing(_as_completed(chunks(), max_pending)) as results:
+            async for result in results:
+                yield result
+
+    async def _aggregate_chunk(
+        self,
+        start: int,
+        chunk: list[ContractFunction | SignatureCall],
+        use_try: bool,
+        block_identifier: BlockIdentifier,
+        isolate_failures: bool,
+    ) -> tuple[int, list]:
+        try:
+            return start, await self._aggregate(chunk, use_try, block_identifier, isolate_failures=isolate_failures)
+        except CallsReverted as e:
+            indexes = [start + i for i in e.indexes]
+            raise CallsReverted(f"{len(indexes)} calls reverted: {indexes}.", indexes, e.results) from e
+
+    def aggregate_range(
+        self,
+        calls: list[ContractFunction | SignatureCall] | Call,
+        blocks: Iterable[BlockIdentifier],
+        use_try: bool = False,
+        addresses: list[ChecksumAddress] | None = None,
+        allow_failure: list[bool] | None = None,
+        columns: bool = False,
+        max_pending: int = 16,
+    ) -> Iterator[tuple[BlockIdentifier, list[Any] | Columns]]:
+        """
+        Same as async_aggregate_range, for sync code
+
+        :return: iterator of (block, results at block)
+        """
+        return self._iterate(
+            self.async_aggregate_range(
+                calls,
+                blocks,
+                use_try=use_try,
+                addresses=addresses,
+                allow_failure=allow_failure,
+                columns=columns,
+                max_pending=max_pending,
+            )
+        )
+
+    async def async_aggregate_range(
+        self,
+        calls: list[ContractFunction | SignatureCall] | Call,
+        blocks: Iterable[BlockIdentifier],
+        use_try: bool = False,
+        addresses: list[ChecksumAddress] | None = None,
+        allow_failure: list[bool] | None = None,
+        columns: bool = False,
+        max_pending: int = 16,
+    ) -> AsyncIterator[tuple[BlockIdentifier, list[Any] | Columns]]:
+        """
+        Aggregates the same calls at every block and yields results of every block as soon as it's done. Calls are
+        encoded once, batches of all blocks in flight are sent concurrently under the instance's request limit. Use
+        Columns.stack to turn per block columns into block by call arrays.
+
+        :param calls: list of contract function (or SignatureCall) calls with parameters or Call encoded in bulk
+        :param blocks: iterable of block identifiers (e.g. range of block numbers)
+        :param use_try: allow calls to fail (tryAggregate), failed calls return None
+        :param addresses: optional list of target addresses corresponding to a list of calls
+        :param allow_failure: optional list of flags corresponding to a list of calls, overrides use_try per call
+        :param columns: return Columns of numpy arrays for every block, calls must have the same static return type
+        :param max_pending: max number of blocks in flight
+        :return: async iterator of (block, results at block), blocks may complete out of order
+        """
+        call, allow_failure = self._prepare_call(calls, addresses, use_try, allow_failure, columns)
+        if not self._ready:
+            await self._async_setup()
+        executions = (self._aggregate_block(call, allow_failure, block, columns) for block in blocks)
+
+        async with aclosing(_as_completed(executions, max_pending)) as results:
+            async for result in results:
+                yield result
+
+    async def _aggregate_block(
+        self, call: Call, allow_failure: list[bool], block_identifier: BlockIdentifier, columns: bool
+    ) -> tuple[BlockIdentifier, list | Columns]:
+        _, output = await self._execute(call, allow_failure, block_identifier, columns=columns)
+        return block_identifier, output
+
+    def _iterate(self, iterator: AsyncIterator[T]) -> Iterator[T]:
+        # steps async iterator in the event loop thread
+        try:
+            while True:
+                try:
+                    yield self._loop_thread.run(iterator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self._loop_thread.run(iterator.aclose())
+
+    @property
+    def dedupe_ratio(self) -> float:
+        """Share of calls that weren't sent because an identical call was in the same aggregate"""
+        return 1 - self.unique_calls / self.total_calls if self.total_calls else 0.0
+
+    @property
+    def _max_calls(self) -> int:
+        if self.pool is not None:
+            return self.pool.batch or self.batch
+        return self.tuner.batch if self.tuner else self.batch
+
+    def _set_chain(self, chain_id: int) -> None:
+        if chain_id in MULTICALL3_ADDRESSES:
+            address, abi, version = MULTICALL3_ADDRESSES[chain_id], multicall3_abi, 3
+        elif chain_id in MULTICALL2_ADDRESSES:
+            address, abi, version = MULTICALL2_ADDRESSES[chain_id], multicall2_abi, 2
+        else:
+            raise ValueError("Connected to unknown chain id!")
+
+        if self.compact:
+            if chain_id in NO_STATE_OVERRIDE:
+                raise ValueError("Compact results need state override, not supported on this chain!")
+            from .bytecode import COMPACT_MULTICALL_BYTECODE
+
+            self._compact_override = {COMPACT_MULTICALL_ADDRESS: {"code": COMPACT_MULTICALL_BYTECODE}}
+
+        if chain_id in MAX_GAS_LIMIT:
+            logger.info("Using network max gas limit")
+            self.gas_limit = MAX_GAS_LIMIT[chain_id]
+
+        self.async_contract = self.async_web3.eth.contract(address=to_checksum_address(address), abi=abi)
+        self.version = version
+        self.chain_id = chain_id
+
+    def _setup(self) -> None:
+        # blocking version of _async_setup, run on the event loop of sync methods
+        self._loop_thread.run(self._async_setup())
+
+    async def _async_setup(self) -> None:
+        url = self._transport.endpoint_uri
+        if "chain_id" not in self.__dict__:
+            if url not in _chain_ids:
+                _chain_ids[url] = int(await self._setup_request("eth_chainId", []), 16)
+            self._set_chain(_chain_ids[url])
+
+        checked, deployed_block = self._cached_deployed()
+        if not checked:
+            try:
+                # code is checked at a known block, earlier blocks may be before multicall was deployed
+                number = int(await self._setup_request("eth_blockNumber", []), 16)
+                code = await self._setup_request("eth_getCode", [self.async_contract.address, hex(number)])
+                deployed_block = self._check_code(HexBytes(code), number)
+            except RETRY_ERRORS as e:
+                logger.debug(f"Failed to get multicall code: '{e}', using state override")
+        self._set_state_override(deployed_block)
+
+    async def _setup_request(self, method: str, params: list) -> Any:
+        # setup requests are made by the first aggregate, they are retried like its batches
+        attempt = 0
+        while True:
+            try:
+                return await self._transport.request(method, params)
+            except RETRY_ERRORS as e:
+                attempt += 1
+                if attempt >= self.max_retries:
+                    raise
+                logger.error(f"Error requesting {method}: '{e}', retrying")
+                await asyncio.sleep(self._retry_delay(attempt))
+
+    def _cached_deployed(self) -> tuple[bool, int | None]:
+        # whether multicall code was checked and block from which it's deployed with the expected code
+        if self.chain_id in NO_STATE_OVERRIDE:
+            return True, 0
+        key = (self._transport.endpoint_uri, self.async_contract.address)
+        return key in _deployed, _deployed.get(key)
+
+    def _check_code(self, code: bytes, block_number: int) -> int | None:
+        code_hash = MULTICALL3_CODE_HASH if self.version == 3 else MULTICALL2_CODE_HASH
+        deployed_block = block_number if keccak(code) == HexBytes(code_hash) else None
+        if deployed_block is not None:
+            logger.debug(f"Multicall is deployed at block {block_number}, state override not needed from it")
+        _deployed[(self._transport.endpoint_uri, self.async_contract.address)] = deployed_block
+        return deployed_block
+
+    def _set_state_override(self, deployed_block: int | None) -> None:
+        self._deployed_block = deployed_block
+        self._ready = True
+
+    @cached_property
+    def _state_override(self) -> dict:
+        from .bytecode import MULTICALL2_BYTECODE, MULTICALL3_BYTECODE
+
+        bytecode = MULTICALL3_BYTECODE if self.version == 3 else MULTICALL2_BYTECODE
+        return {self.async_contract.address: {"code": bytecode}}
+
+    def _block_state_override(self, block_identifier: BlockIdentifier) -> dict | None:
+        # state override is sent at blocks multicall isn't known to be deployed at with the expected bytecode: block tags
+        # and blocks from the one its code was checked at don't need it, older blocks and unknown hashes may
+        if self.chain_id in NO_STATE_OVERRIDE:
+            return None
+        if self._deployed_block is not None:
+            if isinstance(block_identifier, (bytes, bytearray)):
+                block_identifier = self._block_numbers.get(bytes(block_identifier))
+            if block_identifier in ("latest", "pending", "safe", "finalized"):
+                return None
+            if isinstance(block_identifier, int) and block_identifier >= self._deployed_block:
+                return None
+        return self._state_override
+
     def _call_parameters(self, block_identifier: BlockIdentifier):
         parameters = {"transaction": {"gas": self.gas_limit}, "block_identifier": block_identifier}
-
-        # always override if possible
-        if self.chain_id not in NO_STATE_OVERRIDE:
-            parameters["state_override"] = {
-                self.async_contract.address: {"code": MULTICALL3_BYTECODE if self.version == 3 else MULTICALL2_BYTECODE}
-            }
+        state_override = self._block_state_override(block_identifier)
+        if state_override is not None:
+            parameters["state_override"] = state_override
         return parameters
 
+    @property
+    def _has_aggregate3(self) -> bool:
+        return any(item.get("name") == "aggregate3" for item in self.async_contract.abi)
+
     async def _call_aggregate(
         self,
-        use_try: bool,
+        allow_failure: list[bool],
         call_data: list[tuple[ChecksumAddress, HexStr]],
+        return_types: list[list[str]],
         block_identifier: BlockIdentifier,
-    ) -> tuple[int, bytes | bytearray] | bytes | bytearray:
-        if use_try:
-            return await self.async_contract.functions.tryAggregate(False, call_data).call(
-                **self._call_parameters(block_identifier)
-            )
-        return await self.async_contract.functions.aggregate(call_data).call(**self._call_parameters(block_identifier))
+    ) -> list[tuple[bool, bytes | bytearray]]:
+        if self.compact:
+            results = await self._call_compact(call_data, return_types, block_identifier)
+        elif self._has_aggregate3:
+            return await self._call("aggregate3", allow_failure, call_data, block_identifier)
+        elif not any(allow_failure):
+            return await self._call("aggregate", allow_failure, call_data, block_identifier)
+        else:
+            results = await self._call("tryAggregate", allow_failure, call_data, block_identifier)
+
+        # compact multicall and multicall2 have no per call flag, check calls that must succeed here
+        if not all(success or allow for (success, _), allow in zip(results, allow_failure)):
+            raise ContractLogicError("execution reverted: Multicall aggregate: call failed")
+        return results
+
+    async def _call_compact(
+        self,
+        call_data: list[tuple[ChecksumAddress, HexStr]],
+        return_types: list[list[str]],
+        block_identifier: BlockIdentifier,
+    ) -> list[tuple[bool, bytes]]:
+        # static results are returned without padding, widths have to fit in uint16
+        widths = [static_return_size(tuple(return_type)) for return_type in return_types]
+        widths = [width if width <= 0xFFFF else 0 for width in widths]
+
+        transaction = {
+            "to": COMPACT_MULTICALL_ADDRESS,
+            "data": "0x" + encode_compact(call_data, widths).hex(),
+            "gas": hex(self.gas_limit),
+        }
+        # calls may target multicall's own helpers (like getEthBalance), they need its code where it isn't deployed
+        state_override = {**self._compact_override, **(self._block_state_override(block_identifier) or {})}
+        params = [transaction, format_block_identifier(block_identifier), state_override]
+        result = bytes.fromhex((await self._eth_call(params))[2:])
+        return decode_compact(result, widths)
+
+    async def _call(
+        self,
+        method: str,
+        allow_failure: list[bool],
+        call_data: list[tuple[ChecksumAddress, HexStr]],
+        block_identifier: BlockIdentifier,
+    ) -> list[tuple[bool, bytes | bytearray]]:
+        if not self.fast_path:
+            return await self._call_function(method, allow_failure, call_data, block_identifier)
+
+        # encode and decode aggregate directly and send eth_call without web3 middlewares
+        if method == "aggregate3":
+            data = encode_aggregate3(call_data, allow_failure)
+        elif method == "aggregate":
+            data = encode_aggregate(call_data)
+        else:
+            data = encode_try_aggregate(False, call_data)
+
+        transaction = {"to": self.async_contract.address, "data": "0x" + data.hex(), "gas": hex(self.gas_limit)}
+        params = [transaction, format_block_identifier(block_identifier)]
+        state_override = self._block_state_override(block_identifier)
+        if state_override is not None:
+            params.append(state_override)
+
+        result = bytes.fromhex((await self._eth_call(params))[2:])
+        if method == "aggregate":
+            return decode_aggregate(result, self.async_web3.codec)
+        return decode_results(result, self.async_web3.codec)
+
+    async def _eth_call(self, params: list) -> str:
+        if self.hedging is None:
+            return await self._transport.request("eth_call", params)
+        if self.pool is None:
+            return await self.hedging.run(lambda: self._transport.request("eth_call", params))
+        # hedge goes to another endpoint than the request if one is available
+        tried = []
+        return await self.hedging.run(lambda: self.pool.request("eth_call", params, tried))
+
+    async def _call_function(
+        self,
+        method: str,
+        allow_failure: list[bool],
+        call_data: list[tuple[ChecksumAddress, HexStr]],
+        block_identifier: BlockIdentifier,
+    ) -> list[tuple[bool, bytes | bytearray]]:
+        # calls aggregate through web3 contract function
+        if method == "aggregate3":
+            call_data = [(target, allow, data) for (target, data), allow in zip(call_data, allow_failure)]
+            function = self.async_contract.functions.aggregate3(call_data)
+        elif method == "aggregate":
+            function = self.async_contract.functions.aggregate(call_data)
+        else:
+            function = self.async_contract.functions.tryAggregate(False, call_data)
+
+        results = await function.call(**self._call_parameters(block_identifier))
+        if method == "aggregate":
+            return [(True, result) for result in results[1]]
+        return results
 
     async def _parse_aggregate(
         self,
-        use_try: bool,
+        allow_failure: list[bool],
         call_data: list[tuple[ChecksumAddress, HexStr]],
         return_types: list[list[str]],
         block_identifier: BlockIdentifier,
+        decode: bool = True,
     ) -> list:
-        result = await self._call_aggregate(use_try, call_data, block_identifier)
+        async with self._limiter:
+            if self.tuner is None:
+                result = await self._call_aggregate(allow_failure, call_data, return_types, block_identifier)
+            else:
+                epoch, start = self.tuner.epoch, time.monotonic()
+                try:
+                    result = await self._call_aggregate(allow_failure, call_data, return_types, block_identifier)
+                except Exception as e:
+                    self.tuner.failure(epoch, e)
+                    raise
+                self.tuner.success(epoch, time.monotonic() - start)
 
-        output_data = []
-        if use_try:
-            successes, results = list(map(list, zip(*result)))
+        successes, results = list(map(list, zip(*result)))
+        self.planner.observe(call_data, results)
+        if not decode:
+            return result
 
-            for success, result, return_type in zip(successes, results, return_types):
-                if not success:
-                    output_data.append(None)
-                else:
-                    output_data.append(decode_return_data(result, return_type, self.web3.codec))
-        else:
-            _, results = result
-            for result, return_type in zip(results, return_types):
-                output_data.append(decode_return_data(result, return_type, self.web3.codec))
+        output_data = []
+        for success, result, return_type in zip(successes, results, return_types):
+            if not success:
+                output_data.append(None)
+            else:
+                output_data.append(decode_return_data(result, return_type, self.async_web3.codec))
 
         return output_data
 
+    async def _isolate_failures(
+        self,
+        allow_failure: list[bool],
+        call_data: list[tuple[ChecksumAddress, HexStr]],
+        return_types: list[list[str]],
+        block_identifier: BlockIdentifier,
+        decode: bool = True,
+    ) -> list:
+        # bisect reverting batch, healthy halves are decoded as usual and reverting calls are marked with _REVERTED
+        try:
+            return await self._parse_aggregate(allow_failure, call_data, return_types, block_identifier, decode)
+        except ContractLogicError:
+            if len(call_data) == 1:
+                return [_REVERTED]
+
+        middle = len(call_data) // 2
+        left, right = await asyncio.gather(
+            self._isolate_failures(
+                allow_failure[:middle], call_data[:middle], return_types[:middle], block_identifier, decode
+            ),
+            self._isolate_failures(
+                allow_failure[middle:], call_data[middle:], return_types[middle:], block_identifier, decode
+            ),
+        )
+        return left + right
+
     async def _aggregate(
         self,
-        call_list: list[ContractFunction],
+        call_list: list[ContractFunction | SignatureCall] | Call,
         use_try: bool,
         block_identifier: BlockIdentifier,
         target_address_list: list[ChecksumAddress] | None = None,
-    ) -> list:
-        if target_address_list:
-            assert len(target_address_list) == len(call_list), "Lists of addresses and calls should have same length."
+        isolate_failures: bool = False,
+        allow_failure: list[bool] | None = None,
+        columns: bool = False,
+        return_block: bool = False,
+    ) -> list | Columns | tuple[int | None, list | Columns]:
+        call, allow_failure = self._prepare_call(call_list, target_address_list, use_try, allow_failure, columns)
+        isolate_failures = isolate_failures and not all(allow_failure)
 
-        call = Call(call_list, target_address_list)
-        batch = self.batch
-        retries = 0
-        tasks = []
+        if not self._ready:
+            await self._async_setup()
 
-        for i in range(0, len(call.encoded_data), batch):
-            call_data = call.encoded_data[i : i + batch]
-            return_types = call.return_types[i : i + batch]
-            tasks.append(functools.partial(self._parse_aggregate, use_try, call_data, return_types, block_identifier))
+        if (
+            self._coalescer is not None
+            and not isolate_failures
+            and not columns
+            and not return_block
+            and not isinstance(block_identifier, dict)
+            and len(call) < self._max_calls
+        ):
+            block_number, results = await self._coalescer.submit(
+                call, block_identifier, format_block_identifier(block_identifier)
+            )
+            if any(not success and not allowed for (success, _), allowed in zip(results, allow_failure)):
+                # calls that aren't allowed to fail reverted, the caller sends its calls again on their own to get the
+                # same retries and errors as without coalescing
+                block_number, output = await self._execute(call, allow_failure, block_identifier)
+            else:
+                output = self._decode_results(results, call.return_types)
+        else:
+            block_number, output = await self._execute(
+                call, allow_failure, block_identifier, isolate_failures, columns, with_block=return_block
+            )
+        return (block_number, output) if return_block else output
 
-        while True:
-            if retries > self.max_retries - 1:
-                raise MaxRetriesExceeded(f"Failed to call web3multicall after {retries} attempts.")
+    @staticmethod
+    def _prepare_call(
+        call_list: list[ContractFunction | SignatureCall] | Call,
+        target_address_list: list[ChecksumAddress] | None,
+        use_try: bool,
+        allow_failure: list[bool] | None,
+        columns: bool,
+    ) -> tuple[Call, list[bool]]:
+        if isinstance(call_list, Call):
+            assert not target_address_list, "Addresses of Call are set when it's created."
+            call = call_list
+        else:
+            if target_address_list:
+                assert len(target_address_list) == len(
+                    call_list
+                ), "Lists of addresses and calls should have same length."
+            call = Call(call_list, target_address_list)
 
-            task_group = asyncio.gather(*[t() for t in tasks])
-            async with asyncio.Semaphore(self._semaphore):
-                try:
-                    results = await task_group
+        if allow_failure is None:
+            allow_failure = [use_try] * len(call)
+        else:
+            assert len(allow_failure) == len(call), "Lists of allow_failure flags and calls should have same length."
+
+        if columns:
+            if len(call) == 0 or any(return_type != call.return_types[0] for return_type in call.return_types):
+                raise ValueError("Columns need calls with the same return type.")
+            check_columns(call.return_types[0])
+        return call, allow_failure
+
+    async def _execute_shared(
+        self, call: Call, block_identifier: BlockIdentifier
+    ) -> tuple[int | None, list[tuple[bool, bytes]]]:
+        # calls of several aggregates, any of them may fail, callers check their own allow_failure flags
+        return await self._execute(call, [True] * len(call), block_identifier, decode=False)
+
+    async def _execute(
+        self,
+        call: Call,
+        allow_failure: list[bool],
+        block_identifier: BlockIdentifier,
+        isolate_failures: bool = False,
+        columns: bool = False,
+        decode: bool = True,
+        with_block: bool = False,
+    ) -> tuple[int | None, list | Columns]:
+        # identical calls are sent once, their results are copied to every occurrence
+        positions, requested_allow_failure = None, allow_failure
+        self.total_calls += len(call)
+        unique, unique_allow_failure, unique_positions = _deduplicate(call, allow_failure)
+        if len(unique) < len(call):
+            logger.debug(f"Sending {len(unique)} unique calls of {len(call)}")
+            call, allow_failure, positions = unique, unique_allow_failure, unique_positions
+        self.unique_calls += len(call)
+
+        if self.cache is None:
+            block_number, output = await self._run_batches(
+                call, allow_failure, block_identifier, isolate_failures, decode and not columns, with_block
+            )
+        else:
+            block_number, output = await self._run_cached(
+                call, allow_failure, block_identifier, isolate_failures, with_block
+            )
+            if decode and not columns:
+                output = self._decode_results(output, call.return_types)
+
+        if positions is not None:
+            output = [output[position] for position in positions]
+        reverted = [i for i, result in enumerate(output) if result is _REVERTED] if isolate_failures else []
+        for i in reverted:
+            output[i] = (False, b"") if columns else None
+        # copies of reverted calls that may fail aren't errors
+        reverted = [i for i in reverted if not requested_allow_failure[i]]
+        if columns:
+            output = build_columns(output, call.return_types[0])
+        if reverted:
+            raise CallsReverted(f"{len(reverted)} calls reverted: {reverted}.", reverted, output)
+        return block_number, output
+
+    async def _run_cached(
+        self,
+        call: Call,
+        allow_failure: list[bool],
+        block_identifier: BlockIdentifier,
+        isolate_failures: bool,
+        with_block: bool,
+    ) -> tuple[int | None, list]:
+        # (success, return data) of calls, only calls missing in cache are sent. Block number isn't known if all
+        # results at a block hash are cached
+        block, block_identifier, block_number = await self._resolve_block(block_identifier)
+        if block is None:
+            return await self._run_batches(call, allow_failure, block_identifier, isolate_failures, False, with_block)
+
+        output: list = [
+            (True, result) if result is not None else None
+            for result in self.cache.get(self.chain_id, block, call.encoded_data)
+        ]
+        missing = [i for i, result in enumerate(output) if result is None]
+        if missing:
+            missing_call = call.subset(missing)
+            missing_block_number, results = await self._run_batches(
+                missing_call,
+                [allow_failure[i] for i in missing],
+                block_identifier,
+                isolate_failures,
+                False,
+                with_block and block_number is None,
+            )
+            block_number = missing_block_number if block_number is None else block_number
+            self.cache.put(self.chain_id, block, missing_call.encoded_data, results)
+            for i, result in zip(missing, results):
+                output[i] = result
+        return block_number, output
+
+    async def _resolve_block(
+        self, block_identifier: BlockIdentifier
+    ) -> tuple[int | bytes | None, BlockIdentifier, int | None]:
+        # block of cache entries, identifier to send calls with and block number: final blocks are kept by number,
+        # latest and recent blocks are pinned to their hash, other blocks (pending, EIP-1898 dicts) aren't cached
+        if isinstance(block_identifier, (bytes, bytearray)) and len(block_identifier) == 32:
+            return bytes(block_identifier), block_identifier, None
+        if isinstance(block_identifier, int):
+            if not self.cache.is_final(self.chain_id, block_identifier) and self.cache.head_expired(self.chain_id):
+                # head is requested on its own, so older blocks are found to be final without looking each of them up
+                head = await self._transport.request("eth_blockNumber", [])
+                self.cache.set_head(self.chain_id, int(head, 16))
+            if self.cache.is_final(self.chain_id, block_identifier):
+                return block_identifier, block_identifier, block_identifier
+            tag = hex(block_identifier)
+        elif block_identifier in PINNED_TAGS:
+            tag = block_identifier
+        else:
+            return None, block_identifier, None
+
+        block = await self._get_block(tag)
+        if block is None:
+            # block isn't mined yet
+            return None, block_identifier, None
+        number, block_hash = int(block["number"], 16), HexBytes(block["hash"])
+        self.cache.set_block(self.chain_id, number, bytes(block_hash), latest=tag == "latest")
+        # web3 contract functions look up number of block hashes with another request
+        return bytes(block_hash), block_hash if self.fast_path else number, number
+
+    def _decode_results(self, results: list, return_types: list[list[str]]) -> list:
+        return [
+            result
+            if result is _REVERTED
+            else decode_return_data(result[1], return_type, self.async_web3.codec)
+            if result[0]
+            else None
+            for result, return_type in zip(results, return_types)
+        ]
+
+    async def _run_batches(
+        self,
+        call: Call,
+        allow_failure: list[bool],
+        block_identifier: BlockIdentifier,
+        isolate_failures: bool,
+        decode: bool,
+        with_block: bool = False,
+    ) -> tuple[int | None, list]:
+        # block tags are resolved to a block of the node and all batches are sent at its hash, so their results are from
+        # the same block. The number comes from the node since block.number of multicall is the L1 block number on some
+        # L2s (Arbitrum)
+        batches = self.planner.plan(call.encoded_data, call.return_types, self._max_calls, self.gas_limit)
+        block_number = block_identifier if isinstance(block_identifier, int) else None
+        pin = block_identifier in PINNED_TAGS and len(batches) > 1
+        if pin or (with_block and block_number is None):
+            try:
+                block = await self._get_block(block_identifier)
+            except RETRY_ERRORS as e:
+                logger.warning(f"Failed to get block: '{e}', batches aren't pinned to a block")
+                block = None
+            if block is not None:
+                block_number = int(block["number"], 16)
+                if block_identifier in PINNED_TAGS:
+                    # web3 contract functions look up number of block hashes with another request
+                    block_identifier = HexBytes(block["hash"]) if self.fast_path else block_number
+
+        # only batches that failed are sent again, results of successful ones are kept between attempts. Failures are
+        # counted per batch, halves of a split batch inherit its count
+        results: dict[int, list] = {}
+        failures: dict[tuple[int, int], int] = {}
+        pending = batches
+
+        while pending:
+            run_batch = self._isolate_failures if isolate_failures else self._parse_aggregate
+            coroutines = [
+                run_batch(
+                    allow_failure[i:j],
+                    call.encoded_data[i:j],
+                    call.return_types[i:j],
+                    block_identifier,
+                    decode,
+                )
+                for i, j in pending
+            ]
+            outcomes = await asyncio.gather(*coroutines, return_exceptions=True)
+
+            failed, oversized, split = [], [], []
+            for (i, j), outcome in zip(pending, outcomes):
+                if not isinstance(outcome, BaseException):
+                    results[i] = outcome
+                elif not isinstance(outcome, RETRY_ERRORS):
+                    raise outcome
+                elif j - i > 1 and (is_out_of_gas(outcome) or is_response_too_large(outcome)):
+                    # batch was too large, learn from it and split it without using up a retry
+                    oversized.append((i, j))
+                    halves = self._split_batch(call, i, j, outcome)
+                    split.extend(halves)
+                    failures.update((half, failures.get((i, j), 0)) for half in halves)
+                else:
+                    failed.append((i, j))
+                    failures[i, j] = failures.get((i, j), 0) + 1
+                    error = outcome
+
+            if split:
+                batches = sorted(set(batches).difference(oversized).union(split))
+
+            if failed:
+                exhausted = [batch for batch in failed if failures[batch] >= self.max_retries]
+                if exhausted:
+                    failed_batches = [batches.index(batch) for batch in exhausted]
+                    raise MaxRetriesExceeded(
+                        f"Failed to call web3multicall after {self.max_retries} attempts, "
+                        f"failed batches: {failed_batches}.",
+                        failed_batches,
+                    )
+                logger.error(f"Error calling web3multicall:'{error}' in {len(failed)}/{len(batches)} batches, retrying")
+                await asyncio.sleep(self._retry_delay(max(failures[batch] for batch in failed)))
+            pending = sorted(failed + split)
+
+        output = list(itertools.chain(*(results[i] for i in sorted(results))))
+        return block_number, output
+
+    async def _get_block(self, block_identifier: BlockIdentifier) -> dict | None:
+        # block (number and hash) from the node, None if it isn't mined yet
+        block_identifier = format_block_identifier(block_identifier)
+        if isinstance(block_identifier, dict):
+            block_identifier = block_identifier.get("blockHash", block_identifier.get("blockNumber"))
+        method = "eth_getBlockByHash" if len(block_identifier) == 66 else "eth_getBlockByNumber"
+        block = await self._transport.request(method, [block_identifier, False])
+        if block is not None and block.get("hash") is not None:
+            self._block_numbers[bytes(HexBytes(block["hash"]))] = int(block["number"], 16)
+            if len(self._block_numbers) > MAX_BLOCK_NUMBERS:
+                del self._block_numbers[next(iter(self._block_numbers))]
+        return block
+
+    def _split_batch(self, call: Call, start: int, stop: int, error: Exception) -> list[tuple[int, int]]:
+        call_data, return_types = call.encoded_data[start:stop], call.return_types[start:stop]
+        if is_out_of_gas(error):
+            self.planner.out_of_gas(call_data, self.gas_limit)
+        else:
+            self.planner.response_too_large(call_data, return_types)
 
-                except (ContractLogicError, ValueError) as e:
-                    logger.error(f"Error calling web3multicall:'{e}', retrying")
-                    task_group.cancel()
-                    retries += 1
-                    continue
+        batches = self.planner.plan(call_data, return_types, self._max_calls, self.gas_limit)
+        if len(batches) == 1:
+            middle = len(call_data) // 2
+            batches = [(0, middle), (middle, len(call_data))]
+        return [(start + i, start + j) for i, j in batches]
 
-            return list(itertools.chain(*results))
+    def _retry_delay(self, attempt: int) -> float:
+        # exponential backoff with jitter, so retried batches from concurrent aggregates don't arrive together
+        delay = self.retry_backoff * 2 ** (attempt - 1)
+        return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,154 @@
+import logging
+from functools import lru_cache
+
+from eth_abi.grammar import ABIType, TupleType, parse
+from eth_typing import ChecksumAddress, HexStr
+
+logger = logging.getLogger(__name__)
+
+# starting estimates for selectors that were not seen yet
+DEFAULT_CALL_GAS = 50_000
+DEFAULT_DYNAMIC_RETURN_SIZE = 256
+
+# abi encoding overhead of a single call in aggregate input (tuple offset, address, bytes offset and length)
+# and of a single result in output (offset, length and success flag for tryAggregate)
+CALL_OVERHEAD = 128
+RESULT_OVERHEAD = 96
+
+OUT_OF_GAS_ERRORS = ("out of gas", "gas required exceeds", "gas limit reached")
+RESPONSE_TOO_LARGE_ERRORS = ("response size", "response too large", "response is too big", "returndata too large")
+
+
+def _padded(size: int) -> int:
+    return (size + 31) // 32 * 32
+
+
+def _static_size(abi_type: ABIType) -> int | None:
+    if abi_type.is_dynamic:
+        return None
+    if abi_type.is_array:
+        return abi_type.arrlist[-1][0] * _static_size(abi_type.item_type)
+    if isinstance(abi_type, TupleType):
+        return sum(_static_size(component) for component in abi_type.components)
+    return 32
+
+
+@lru_cache(maxsize=None)
+def estimate_return_size(return_type: tuple[str, ...]) -> int:
+    """Size of abi encoded return data, dynamic types are counted with a default estimate."""
+    size = 0
+    for abi_type in return_type:
+        static_size = _static_size(parse(abi_type))
+        size += DEFAULT_DYNAMIC_RETURN_SIZE if static_size is None else static_size
+    return size
+
+
+@lru_cache(maxsize=None)
+def static_return_size(return_type: tuple[str, ...]) -> int:
+    """Size of abi encoded return data, 0 if any of types is dynamic."""
+    size = 0
+    for abi_type in return_type:
+        static_size = _static_size(parse(abi_type))
+        if static_size is None:
+            return 0
+        size += static_size
+    return size
+
+
+def is_out_of_gas(error: Exception) -> bool:
+    return any(message in str(error).lower() for message in OUT_OF_GAS_ERRORS)
+
+
+def is_response_too_large(error: Exception) -> bool:
+    return any(message in str(error).lower() for message in RESPONSE_TOO_LARGE_ERRORS)
+
+
+class BatchPlanner:
+    """
+    Packs calls into batches against gas, calldata and return data budgets instead of a fixed number of calls.
+
+    Costs are tracked per function selector: return sizes are learned from results of earlier batches, gas estimates
+    can't be observed from eth_call and are only raised after a batch runs out of gas.
+    """
+
+    def __init__(self, max_calldata_bytes: int = 250_000, max_return_bytes: int = 1_000_000):
+        self.max_calldata_bytes = max_calldata_bytes
+        self.max_return_bytes = max_return_bytes
+
+        self.gas: dict[str, int] = {}
+        self.return_size: dict[str, int] = {}
+
+    def plan(
+        self,
+        call_data: list[tuple[ChecksumAddress, HexStr]],
+        return_types: list[list[str]],
+        max_calls: int,
+        gas_limit: int,
+    ) -> list[tuple[int, int]]:
+        """
+        Splits calls into consecutive batches, every batch has at least one call
+
+        :param call_data: encoded calls
+        :param return_types: return types of calls
+        :param max_calls: max number of calls in a batch
+        :param gas_limit: gas available for a batch
+        :return: list of (start, stop) slices of call_data
+        """
+        batches = []
+        start = 0
+        gas = calldata_bytes = return_bytes = 0
+
+        for i, ((_, data), return_type) in enumerate(zip(call_data, return_types)):
+            call_gas, call_bytes, result_bytes = self._costs(data, return_type)
+
+            if i > start and (
+                i - start >= max_calls
+                or gas + call_gas > gas_limit
+                or calldata_bytes + call_bytes > self.max_calldata_bytes
+                or return_bytes + result_bytes > self.max_return_bytes
+            ):
+                batches.append((start, i))
+                start = i
+                gas = calldata_bytes = return_bytes = 0
+
+            gas += call_gas
+            calldata_bytes += call_bytes
+            return_bytes += result_bytes
+
+        if start < len(call_data):
+            batches.append((start, len(call_data)))
+        return batches
+
+    def _costs(self, data: HexStr, return_type: list[str]) -> tuple[int, int, int]:
+        selector = data[:10]
+        return (
+            self.gas.get(selector, DEFAULT_CALL_GAS),
+            CALL_OVERHEAD + _padded(len(data) // 2 - 1),
+            RESULT_OVERHEAD + self.return_size.get(selector, estimate_return_size(tuple(return_type))),
+        )
+
+    def observe(self, call_data: list[tuple[ChecksumAddress, HexStr]], results: list[bytes]) -> None:
+        """Learns return sizes from results of a successful batch"""
+        for (_, data), result in zip(call_data, results):
+            selector = data[:10]
+            size = _padded(len(result))
+            if size > self.return_size.get(selector, 0):
+                self.return_size[selector] = size
+
+    def out_of_gas(self, call_data: list[tuple[ChecksumAddress, HexStr]], gas_limit: int) -> None:
+        """
+        Raises gas estimates of selectors in a batch that ran out of gas, so that twice the average gas per call would
+        have been assumed. Concurrent batches of the same size failing raise estimates only once.
+        """
+        estimate = min(2 * gas_limit // len(call_data), gas_limit)
+        for selector in {data[:10] for _, data in call_data}:
+            self.gas[selector] = max(self.gas.get(selector, DEFAULT_CALL_GAS), estimate)
+        logger.debug(f"Batch of {len(call_data)} calls ran out of gas, raised gas estimates")
+
+    def response_too_large(
+        self, call_data: list[tuple[ChecksumAddress, HexStr]], return_types: list[list[str]]
+    ) -> None:
+        """Provider limits response size below the return data budget, lowers budget to half of the batch size"""
+        return_bytes = sum(self._costs(data, return_type)[2] for (_, data), return_type in zip(call_data, return_types))
+        self.max_return_bytes = max(min(self.max_return_bytes, return_bytes // 2), RESULT_OVERHEAD)
+        logger.debug(f"Response for batch of {len(call_data)} calls was too large, max return bytes lowered")
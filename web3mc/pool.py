@@ -0,0 +1,217 @@
+import logging
+import random
+import time
+from typing import Any
+
+from web3 import AsyncHTTPProvider
+from web3.exceptions import ContractLogicError
+
+from .limiter import ConcurrencyLimiter
+from .planner import is_out_of_gas, is_response_too_large
+from .ratelimit import RateLimit
+from .transport import RPCTransport
+from .tuner import AutoTuner
+
+logger = logging.getLogger(__name__)
+
+# weight of the newest sample in moving averages of latency and error rate
+EWMA_ALPHA = 0.2
+# share of its traffic an endpoint keeps at worst error rate, so it keeps being measured
+MIN_SUCCESS_RATE = 0.05
+
+
+def is_endpoint_error(error: Exception) -> bool:
+    # errors of the endpoint (connection errors, timeouts, rate limits, server errors), reverts, out of gas and too
+    # large responses come from the calls and would fail on any endpoint
+    if isinstance(error, ContractLogicError):
+        return False
+    return not (is_out_of_gas(error) or is_response_too_large(error))
+
+
+class Endpoint:
+    """
+    Transport of a provider url with its health: moving averages of latency and error rate and a circuit breaker.
+
+    The circuit opens after failure_threshold consecutive failures and the endpoint gets no requests for cooldown
+    seconds. Then a single trial request is let through (half-open), its success closes the circuit, its failure opens
+    it again for twice as long (up to max_cooldown).
+
+    Requests in flight are capped by a limiter of the endpoint, tuned by its own tuner (if any), so a slow or rate
+    limited endpoint doesn't lower concurrency of the others.
+    """
+
+    def __init__(
+        self,
+        transport: RPCTransport,
+        failure_threshold: int,
+        cooldown: float,
+        max_cooldown: float,
+        concurrency: int = 1000,
+        tune_batch: int | None = None,
+    ):
+        self.transport = transport
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.limiter = ConcurrencyLimiter(concurrency)
+        self.tuner = AutoTuner(self.limiter, tune_batch) if tune_batch is not None else None
+
+        self.latency: float | None = None
+        self.error_rate = 0.0
+        self.requests = 0
+        # consecutive failures
+        self.failures = 0
+        self.cooldown = cooldown
+        self.opened_at: float | None = None
+        self.trial = False
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.url!r}, state={self.state!r})"
+
+    @property
+    def url(self) -> str:
+        return self.transport.endpoint_uri
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() >= self.opened_at + self.cooldown else "open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or state == "half-open" and not self.trial
+
+    def weight(self, default_latency: float) -> float:
+        latency = self.latency if self.latency is not None else default_latency
+        return max(1 - self.error_rate, MIN_SUCCESS_RATE) / max(latency, 1e-3)
+
+    def success(self, latency: float) -> None:
+        self.requests += 1
+        self.latency = latency if self.latency is None else self.latency + EWMA_ALPHA * (latency - self.latency)
+        self.error_rate -= EWMA_ALPHA * self.error_rate
+        self.failures = 0
+        if self.opened_at is not None:
+            logger.info(f"Provider {self.url} recovered, closing circuit")
+            self.opened_at, self.cooldown = None, self.base_cooldown
+
+    def failure(self, trial: bool = False) -> None:
+        self.requests += 1
+        self.error_rate += EWMA_ALPHA * (1 - self.error_rate)
+        self.failures += 1
+        if trial:
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+        elif self.opened_at is not None or self.failures < self.failure_threshold:
+            # requests sent before the circuit opened don't extend it
+            return
+        logger.warning(f"Provider {self.url} failed {self.failures} times in a row, ejected for {self.cooldown}s")
+        self.opened_at = time.monotonic()
+
+
+class ProviderPool:
+    """
+    Spreads requests over endpoints of the same chain, weighted by their success rate over latency. Endpoints that
+    keep failing are ejected for a while by their circuit breaker, requests failing with endpoint errors are sent
+    again to another available endpoint right away. If every endpoint is ejected, the one ejected first is used.
+
+    Has the request interface of RPCTransport. Each endpoint caps its requests in flight at concurrency, with
+    tune_batch set batch size and concurrency are tuned per endpoint starting from it.
+    """
+
+    def __init__(
+        self,
+        transports: list[RPCTransport],
+        failure_threshold: int = 5,
+        cooldown: float = 30.0,
+        max_cooldown: float = 600.0,
+        concurrency: int = 1000,
+        tune_batch: int | None = None,
+    ):
+        if not transports:
+            raise ValueError("Provider pool needs at least one endpoint.")
+        self.endpoints = [
+            Endpoint(transport, failure_threshold, cooldown, max_cooldown, concurrency, tune_batch)
+            for transport in transports
+        ]
+        # number of requests sent again to another endpoint after an endpoint error
+        self.redispatched = 0
+
+    @classmethod
+    def from_urls(
+        cls,
+        urls: list[str],
+        max_batch_bytes: int | None = None,
+        rate_limits: dict[str, RateLimit] | None = None,
+        **kwargs,
+    ) -> "ProviderPool":
+        rate_limits = rate_limits or {}
+        return cls(
+            [RPCTransport(AsyncHTTPProvider(url), max_batch_bytes, rate_limits.get(url)) for url in urls], **kwargs
+        )
+
+    @property
+    def provider(self) -> AsyncHTTPProvider:
+        return self.endpoints[0].transport.provider
+
+    @property
+    def endpoint_uri(self) -> str:
+        return self.endpoints[0].url
+
+    @property
+    def batch(self) -> int | None:
+        """Largest tuned batch size of available endpoints (of all endpoints if none is available), None if not tuned"""
+        tuners = [endpoint.tuner for endpoint in self.endpoints if endpoint.tuner is not None and endpoint.available()]
+        tuners = tuners or [endpoint.tuner for endpoint in self.endpoints if endpoint.tuner is not None]
+        return max(tuner.batch for tuner in tuners) if tuners else None
+
+    async def request(self, method: str, params: list, tried: list[Endpoint] | None = None) -> Any:
+        """
+        :param tried: endpoints to avoid if others are available, endpoints this request is sent to are added to it (a
+            list shared by duplicates of a request sends them to different endpoints)
+        """
+        tried = [] if tried is None else tried
+        while True:
+            endpoint = self._choose(tried)
+            tried.append(endpoint)
+            trial = endpoint.trial = endpoint.opened_at is not None
+            try:
+                async with endpoint.limiter:
+                    epoch = endpoint.tuner.epoch if endpoint.tuner is not None else 0
+                    start = time.monotonic()
+                    result = await endpoint.transport.request(method, params)
+            except Exception as e:
+                latency = time.monotonic() - start
+                if endpoint.tuner is not None:
+                    endpoint.tuner.failure(epoch, e)
+                if not is_endpoint_error(e):
+                    endpoint.success(latency)
+                    raise
+                endpoint.failure(trial)
+                if not any(other.available() for other in self.endpoints if other not in tried):
+                    raise
+                logger.debug(f"Request to {endpoint.url} failed: '{e}', sending it to another provider")
+                self.redispatched += 1
+                continue
+            finally:
+                if trial:
+                    endpoint.trial = False
+            latency = time.monotonic() - start
+            if endpoint.tuner is not None:
+                endpoint.tuner.success(epoch, latency)
+            endpoint.success(latency)
+            return result
+
+    def _choose(self, tried: list[Endpoint]) -> Endpoint:
+        available = [endpoint for endpoint in self.endpoints if endpoint.available()]
+        candidates = [endpoint for endpoint in available if endpoint not in tried] or available
+        if not candidates:
+            # every endpoint is ejected, try the one whose cooldown ends first instead of failing
+            return min(self.endpoints, key=lambda endpoint: endpoint.opened_at + endpoint.cooldown)
+        if len(candidates) == 1:
+            return candidates[0]
+
+        # endpoints without measured latency get the best one, so they are tried early
+        latencies = [endpoint.latency for endpoint in self.endpoints if endpoint.latency is not None]
+        default_latency = min(latencies, default=1.0)
+        weights = [endpoint.weight(default_latency) for endpoint in candidates]
+        return random.choices(candidates, weights)[0]
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Mapping
+
+# compute units of a request from its method and params
+Weight = Callable[[str, list], float]
+
+
+def parse_retry_after(headers: Mapping[str, str] | None) -> float | None:
+    """Seconds to wait from Retry-After header (delay in seconds or HTTP date), None if it's missing or invalid"""
+    value = (headers or {}).get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate tokens per second up to capacity. Tokens are reserved ahead, so concurrent callers
+    are spaced evenly and a cost larger than capacity is paid off over time instead of never fitting.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0:
+            raise ValueError("Rate should be positive.")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        # time tokens were counted at, in the future while paused
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, cost: float) -> float:
+        """Takes cost tokens, returns seconds to wait until they are refilled"""
+        with self._lock:
+            now = time.monotonic()
+            if now > self._updated:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+            self._tokens -= cost
+            return max(0.0, self._updated - now - min(self._tokens, 0) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Stops refilling for seconds, bucket starts empty afterwards"""
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._updated:
+                self._tokens = min(self._tokens, 0)
+                self._updated = until
+
+
+class RateLimit:
+    """
+    Client side limit of requests per second and (optionally) compute units per second of an endpoint, with weight
+    giving compute units of a request (1 if not set). Can be shared by Multicall instances using the same provider key.
+
+    Requests wait for their turn instead of being sent in bursts, at most burst seconds of unused budget is saved up.
+    A 429 response with Retry-After pauses all requests for that time.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float,
+        compute_units_per_second: float | None = None,
+        weight: Weight | None = None,
+        burst: float = 0.1,
+    ):
+        self.weight = weight
+        self.requests = TokenBucket(requests_per_second, max(1.0, requests_per_second * burst))
+        self.compute_units = (
+            TokenBucket(compute_units_per_second, compute_units_per_second * burst)
+            if compute_units_per_second is not None
+            else None
+        )
+        # number of requests that had to wait, total seconds waited and number of Retry-After pauses
+        self.delayed = 0
+        self.waited = 0.0
+        self.pauses = 0
+
+    async def acquire(self, method: str, params: list) -> None:
+        delay = self.requests.reserve(1)
+        if self.compute_units is not None:
+            cost = self.weight(method, params) if self.weight is not None else 1
+            delay = max(delay, self.compute_units.reserve(cost))
+        if delay > 0:
+            self.delayed += 1
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        self.pauses += 1
+        self.requests.pause(seconds)
+        if self.compute_units is not None:
+            self.compute_units.pause(seconds)
@@ -0,0 +1,185 @@
+import asyncio
+import itertools
+import json
+import logging
+from typing import Any
+
+from aiohttp import ClientResponseError, ClientTimeout
+from web3 import AsyncHTTPProvider
+from web3._utils.contract_error_handling import raise_contract_logic_error_on_revert
+from web3._utils.request import DEFAULT_TIMEOUT, async_cache_and_return_session
+from web3.types import BlockIdentifier
+
+from .ratelimit import RateLimit, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+# http statuses used by providers that don't accept batch requests
+BATCH_REJECTED_STATUSES = (400, 405, 415, 501)
+PAYLOAD_TOO_LARGE = 413
+TOO_MANY_REQUESTS = 429
+
+
+def format_block_identifier(block_identifier: BlockIdentifier) -> str | dict:
+    if isinstance(block_identifier, int):
+        return hex(block_identifier)
+    if isinstance(block_identifier, (bytes, bytearray)):
+        return "0x" + bytes(block_identifier).hex()
+    return block_identifier
+
+
+def parse_response(response: dict) -> Any:
+    """Returns result of JSON-RPC response or raises the same errors as web3 (ContractLogicError on reverts)"""
+    if "error" in response:
+        raise_contract_logic_error_on_revert(response)
+        raise ValueError(response["error"])
+    return response["result"]
+
+
+class RPCTransport:
+    """
+    Sends JSON-RPC requests to provider endpoint directly, reusing web3 session cache. With rate_limit requests wait
+    for their turn, a 429 response with Retry-After pauses requests of the limit for that time.
+
+    With max_batch_bytes requests issued in the same event loop iteration are packed into JSON-RPC batch requests of
+    up to max_batch_bytes (a single larger request is sent alone) and responses are matched back by id. Batching is
+    turned off for the rest of the session if provider rejects batch requests.
+    """
+
+    def __init__(
+        self, provider: AsyncHTTPProvider, max_batch_bytes: int | None = None, rate_limit: RateLimit | None = None
+    ):
+        self.provider = provider
+        self.max_batch_bytes = max_batch_bytes
+        self.rate_limit = rate_limit
+        self.batching = max_batch_bytes is not None
+
+        self._ids = itertools.count()
+        # requests waiting to be sent, per event loop
+        self._queues: dict[asyncio.AbstractEventLoop, list[tuple[int, str, asyncio.Future]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def endpoint_uri(self) -> str:
+        return self.provider.endpoint_uri
+
+    async def request(self, method: str, params: list) -> Any:
+        if self.rate_limit is not None:
+            await self.rate_limit.acquire(method, params)
+        request_id = next(self._ids)
+        payload = json.dumps({"jsonrpc": "2.0", "method": method, "params": params, "id": request_id})
+
+        if not self.batching:
+            return parse_response(json.loads(await self._post(payload)))
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if loop not in self._queues:
+            self._queues[loop] = []
+            loop.call_soon(self._flush, loop)
+        self._queues[loop].append((request_id, payload, future))
+        return parse_response(await future)
+
+    async def _post(self, data: str) -> bytes:
+        # web3 keeps its session cache lock forever if a request is cancelled while waiting for it (hedged requests are
+        # cancelled), so the session is looked up in a task of its own
+        session = await asyncio.shield(async_cache_and_return_session(self.endpoint_uri))
+        kwargs = {"timeout": ClientTimeout(DEFAULT_TIMEOUT), **self.provider.get_request_kwargs()}
+        try:
+            async with session.post(self.endpoint_uri, data=data, **kwargs) as response:
+                response.raise_for_status()
+                return await response.read()
+        except ClientResponseError as e:
+            if e.status == TOO_MANY_REQUESTS and self.rate_limit is not None:
+                delay = parse_retry_after(e.headers)
+                if delay is not None:
+                    logger.debug(f"Provider {self.endpoint_uri} is rate limited, pausing requests for {delay}s")
+                    self.rate_limit.pause(delay)
+            raise
+
+    def _flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        queue = self._queues.pop(loop)
+
+        # size of "[" + requests joined with "," + "]"
+        batch, size = [], 1
+        for request in queue:
+            if batch and size + len(request[1]) + 1 > self.max_batch_bytes:
+                self._spawn(self._send(batch))
+                batch, size = [], 1
+            batch.append(request)
+            size += len(request[1]) + 1
+        if batch:
+            self._spawn(self._send(batch))
+
+    def _spawn(self, coroutine) -> None:
+        # keep references to running tasks, event loop only keeps weak ones
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_one(self, request: tuple[int, str, asyncio.Future]) -> None:
+        _, payload, future = request
+        try:
+            response = json.loads(await self._post(payload))
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(response)
+
+    async def _send(self, batch: list[tuple[int, str, asyncio.Future]]) -> None:
+        if len(batch) == 1 or not self.batching:
+            await asyncio.gather(*[self._send_one(request) for request in batch])
+            return
+
+        try:
+            responses = await self._send_batch(batch)
+            if responses is None:
+                return
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_id = {response.get("id"): response for response in responses}
+        for request_id, _, future in batch:
+            if future.done():
+                continue
+            response = by_id.get(request_id)
+            if response is None:
+                future.set_exception(ValueError({"code": -32603, "message": "Missing response in JSON-RPC batch"}))
+            else:
+                future.set_result(response)
+
+    async def _send_batch(self, batch: list[tuple[int, str, asyncio.Future]]) -> list[dict] | None:
+        # returns None if requests were sent again in smaller batches or one by one
+        try:
+            response = json.loads(await self._post("[" + ",".join(payload for _, payload, _ in batch) + "]"))
+        except ClientResponseError as e:
+            if e.status == PAYLOAD_TOO_LARGE:
+                self.max_batch_bytes = sum(len(payload) for _, payload, _ in batch) // 2
+                logger.debug(f"Batch request too large, lowered max batch size to {self.max_batch_bytes} bytes")
+                middle = len(batch) // 2
+                await asyncio.gather(self._send(batch[:middle]), self._send(batch[middle:]))
+                return None
+            if e.status not in BATCH_REJECTED_STATUSES:
+                raise
+            response = {"error": {"code": e.status, "message": e.message}}
+
+        if isinstance(response, list):
+            return response
+
+        error = response.get("error") or {}
+        if error.get("code") not in (-32600, *BATCH_REJECTED_STATUSES) and "batch" not in str(error.get("message")):
+            # error for the whole request (e.g. rate limit), not related to batching
+            return [{"id": request_id, "error": error} for request_id, _, _ in batch]
+
+        if self.batching:
+            logger.warning(
+                f"Provider {self.endpoint_uri} rejected batch request ({error}), sending requests one by one"
+            )
+            self.batching = False
+        await self._send(batch)
+        return None
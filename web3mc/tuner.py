@@ -0,0 +1,103 @@
+import asyncio
+import logging
+
+from aiohttp import ClientResponseError
+
+from .limiter import ConcurrencyLimiter
+from .planner import is_out_of_gas, is_response_too_large
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ERRORS = ("429", "rate limit", "too many requests", "exceeded the quota", "capacity exceeded")
+TIMEOUT_ERRORS = ("timeout", "timed out")
+
+
+def is_rate_limited(error: Exception) -> bool:
+    if isinstance(error, ClientResponseError):
+        return error.status == 429
+    return any(message in str(error).lower() for message in RATE_LIMIT_ERRORS)
+
+
+def is_timeout(error: Exception) -> bool:
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    return any(message in str(error).lower() for message in TIMEOUT_ERRORS)
+
+
+class AutoTuner:
+    """
+    Tunes batch size and concurrency of a provider at runtime with AIMD: both grow additively (about one step per
+    round of concurrent requests) while requests are fast and are halved on congestion signals.
+
+    - rate limits and requests slower than target latency halve concurrency
+    - timeouts halve concurrency and batch size
+    - out of gas and too large responses halve batch size
+
+    Every signal is acted on once per round, failures of requests sent before the last decrease are ignored.
+    """
+
+    def __init__(
+        self,
+        limiter: ConcurrencyLimiter,
+        batch: int,
+        concurrency: int = 16,
+        max_batch: int | None = None,
+        max_concurrency: int | None = None,
+        target_latency: float = 2.0,
+    ):
+        self.limiter = limiter
+        self.max_batch = max_batch or 10 * batch
+        self.max_concurrency = max_concurrency or limiter.limit
+        self.target_latency = target_latency
+        self.batch_step = max(1, batch // 10)
+
+        self._batch = float(batch)
+        self._concurrency = float(min(concurrency, self.max_concurrency))
+        self.limiter.limit = self.concurrency
+
+        # incremented on every decrease
+        self.epoch = 0
+
+    @property
+    def batch(self) -> int:
+        return int(self._batch)
+
+    @property
+    def concurrency(self) -> int:
+        return int(self._concurrency)
+
+    @property
+    def settings(self) -> dict[str, int]:
+        return {"batch": self.batch, "concurrency": self.concurrency}
+
+    def success(self, epoch: int, latency: float) -> None:
+        if latency > self.target_latency:
+            self._decrease(epoch, concurrency=True, reason=f"latency {latency:.2f}s")
+            return
+
+        self._batch = min(self._batch + self.batch_step / self._concurrency, self.max_batch)
+        self._concurrency = min(self._concurrency + 1 / self._concurrency, self.max_concurrency)
+        self.limiter.limit = self.concurrency
+
+    def failure(self, epoch: int, error: Exception) -> None:
+        if is_rate_limited(error):
+            self._decrease(epoch, concurrency=True, reason="rate limit")
+        elif is_timeout(error):
+            self._decrease(epoch, batch=True, concurrency=True, reason="timeout")
+        elif is_out_of_gas(error) or is_response_too_large(error):
+            self._decrease(epoch, batch=True, reason="batch too large")
+
+    def _decrease(self, epoch: int, batch: bool = False, concurrency: bool = False, reason: str = "") -> None:
+        if epoch < self.epoch:
+            return
+        self.epoch += 1
+
+        if batch:
+            self._batch = max(self._batch / 2, 1)
+        if concurrency:
+            self._concurrency = max(self._concurrency / 2, 1)
+            self.limiter.limit = self.concurrency
+        logger.debug(f"Decreased multicall settings to {self.settings} ({reason})")
+
+    def __repr__(self) -> str:
+        return f"AutoTuner(batch={self.batch}, concurrency={self.concurrency})"